@@ -0,0 +1,581 @@
+"""
+Banco de pruebas de carga de bot_hyperliquid contra una API de Hyperliquid simulada.
+
+Levanta un mock de /info (userFills, userFillsByTime, clearinghouseState,
+allMids) con latencia, tasa de errores y fills por wallet configurables, y de
+/ws (suscripciones userFills con el límite de usuarios por IP de Hyperliquid),
+y para cada número de wallets arranca el bot en un proceso aparte con un bot de
+Telegram falso que solo cuenta mensajes. Mide el monitor (duración de los
+barridos, alertas/s, latencia fill→alerta p50/p99), un /summary y el consumo de
+CPU y memoria del proceso del bot. Al acabar deja de generar fills y comprueba
+que cada fill generado se ha alertado una vez (missed_alerts). El resultado es
+JSON para poder comparar versiones; el código de salida es 1 si algún
+escenario falla o pierde alertas, así sirve de test de extremo a extremo.
+
+Uso:
+    python bench_hyperliquid.py --wallets 10,100,1000,10000 --duration 60 --output bench.json
+    python bench_hyperliquid.py --wallets 30 --streaming --ws-disconnect-every 20
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+from types import SimpleNamespace
+
+from aiohttp import web
+
+COINS = ("BTC", "ETH", "SOL", "HYPE", "ARB", "DOGE", "AVAX", "LINK")
+MIDS = {"BTC": 60000.0, "ETH": 3000.0, "SOL": 150.0, "HYPE": 30.0, "ARB": 0.8, "DOGE": 0.15, "AVAX": 30.0, "LINK": 15.0}
+DIRS = ("Open Long", "Close Long", "Open Short", "Close Short")
+
+# Máximo de fills que devuelve la API por petición (igual que HL_FILLS_PAGE_SIZE)
+PAGE_SIZE = 2000
+
+def percentile(values: list, pct: float):
+    """
+    Percentil por rango más cercano; None si no hay valores.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    index = max(0, min(len(values) - 1, round(pct / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+def distribution(values: list) -> dict:
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else None,
+    }
+
+# -----------------------
+# API de Hyperliquid simulada
+# -----------------------
+
+class MockHyperliquid:
+    """
+    Mock de /info y /ws. Cada wallet genera fills como un proceso de Poisson de
+    `fills_per_minute` desde su primera consulta o suscripción (aunque se
+    rechace), de modo que la latencia
+    fill→alerta incluye la espera hasta el siguiente sondeo. /control congela
+    la generación y devuelve cuántos fills se han generado.
+    En /ws cada IP puede suscribir como mucho `ws_max_users` usuarios distintos
+    (sumando sus conexiones); las suscripciones de más reciben un error en el
+    canal "error", como en Hyperliquid. Con `ws_disconnect_every` cada conexión
+    se cierra pasados esos segundos.
+    """
+
+    def __init__(self, latency: float, jitter: float, error_rate: float, error_status: int,
+                 fills_per_minute: float, positions: int, ws_max_users: int = 10,
+                 ws_disconnect_every: float = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.fills_per_minute = fills_per_minute
+        self.positions = positions
+        self.ws_max_users = ws_max_users
+        self.ws_disconnect_every = ws_disconnect_every
+        self.reset()
+
+    def reset(self):
+        # { address: {"generated_until": ms, "fills": [...]} }
+        self.wallets = {}
+        self.next_tid = 1
+        self.generated = 0
+        self.frozen = False
+        self.requests = {}
+        self.errors = 0
+        # { ip: { user: conexiones que lo tienen suscrito } }
+        self.ws_users = {}
+        self.ws_stats = {"connections": 0, "acked": 0, "rejected": 0, "pushed_fills": 0}
+        self.cpu_started = time.process_time()
+
+    def stats(self) -> dict:
+        return {
+            "requests": dict(self.requests),
+            "injected_errors": self.errors,
+            "fills_generated": self.generated,
+            "ws": dict(self.ws_stats),
+            "mock_cpu_s": round(time.process_time() - self.cpu_started, 3),
+        }
+
+    def _fills(self, address: str) -> list:
+        now = int(time.time() * 1000)
+        wallet = self.wallets.get(address)
+        if wallet is None:
+            wallet = self.wallets[address] = {"generated_until": now, "fills": []}
+        rate = self.fills_per_minute / 60000
+        t = wallet["generated_until"]
+        while rate > 0 and not self.frozen:
+            t += random.expovariate(rate)
+            if t > now:
+                break
+            wallet["fills"].append(self._new_fill(int(t)))
+            self.generated += 1
+        wallet["generated_until"] = now
+        if len(wallet["fills"]) > PAGE_SIZE:
+            del wallet["fills"][:-PAGE_SIZE]
+        return wallet["fills"]
+
+    def _new_fill(self, ms: int) -> dict:
+        coin = random.choice(COINS)
+        direction = random.choice(DIRS)
+        tid = self.next_tid
+        self.next_tid += 1
+        return {
+            "coin": coin,
+            "px": f"{MIDS[coin] * random.uniform(0.99, 1.01):.4f}",
+            "sz": f"{random.uniform(0.01, 10):.4f}",
+            "side": "B" if direction in ("Open Long", "Close Short") else "A",
+            "time": ms,
+            "startPosition": "0.0",
+            "dir": direction,
+            "closedPnl": "0.0",
+            "hash": f"0x{tid:064x}",
+            "oid": tid,
+            "crossed": True,
+            "fee": "0.01",
+            "tid": tid,
+            "feeToken": "USDC",
+        }
+
+    async def info(self, request):
+        body = await request.json()
+        kind = body.get("type")
+        self.requests[kind] = self.requests.get(kind, 0) + 1
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+        if self.error_rate and random.random() < self.error_rate:
+            self.errors += 1
+            return web.Response(status=self.error_status, text="injected error")
+        if kind == "userFills":
+            return web.json_response(self._fills(body["user"])[::-1])
+        if kind == "userFillsByTime":
+            start, end = body["startTime"], body.get("endTime")
+            fills = [
+                f for f in self._fills(body["user"])
+                if f["time"] >= start and (end is None or f["time"] <= end)
+            ]
+            return web.json_response(fills[:PAGE_SIZE])
+        if kind == "clearinghouseState":
+            positions = []
+            for coin in COINS[:self.positions]:
+                size = random.uniform(-5, 5)
+                positions.append({"type": "oneWay", "position": {
+                    "coin": coin,
+                    "szi": f"{size:.4f}",
+                    "entryPx": f"{MIDS[coin]:.4f}",
+                    "positionValue": f"{abs(size) * MIDS[coin]:.2f}",
+                    "unrealizedPnl": "0.0",
+                    "leverage": {"type": "cross", "value": 10},
+                }})
+            return web.json_response({"assetPositions": positions, "marginSummary": {"accountValue": "100000.0"}})
+        if kind == "allMids":
+            return web.json_response({coin: f"{px:.4f}" for coin, px in MIDS.items()})
+        return web.json_response({"error": f"unknown type {kind}"}, status=422)
+
+    async def control(self, request):
+        if request.method == "POST":
+            freeze = bool((await request.json()).get("freeze"))
+            if freeze:
+                # Se generan los fills pendientes de todas las wallets, también
+                # las que nadie consulta
+                for address in list(self.wallets):
+                    self._fills(address)
+            self.frozen = freeze
+        return web.json_response({"fills_generated": self.generated, "frozen": self.frozen})
+
+    async def ws(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.ws_stats["connections"] += 1
+        ip_users = self.ws_users.setdefault(request.remote, {})
+        # { user: tid del último fill enviado }
+        subscribed = {}
+
+        async def push():
+            while not ws.closed:
+                await asyncio.sleep(0.2)
+                for user, last_tid in list(subscribed.items()):
+                    fresh = [f for f in self._fills(user) if f["tid"] > last_tid]
+                    if fresh and user in subscribed:
+                        subscribed[user] = fresh[-1]["tid"]
+                        self.ws_stats["pushed_fills"] += len(fresh)
+                        await ws.send_json({"channel": "userFills", "data": {"user": user, "fills": fresh}})
+
+        pusher = asyncio.create_task(push())
+        closer = None
+        if self.ws_disconnect_every:
+            closer = asyncio.get_running_loop().call_later(
+                self.ws_disconnect_every, lambda: asyncio.ensure_future(ws.close())
+            )
+        try:
+            async for msg in ws:
+                body = json.loads(msg.data)
+                if body.get("method") == "ping":
+                    await ws.send_json({"channel": "pong"})
+                    continue
+                subscription = body.get("subscription", {})
+                user = subscription.get("user", "").lower()
+                if body.get("method") == "subscribe":
+                    self._fills(user)
+                    if user not in ip_users and len(ip_users) >= self.ws_max_users:
+                        self.ws_stats["rejected"] += 1
+                        await ws.send_json({"channel": "error", "data": f"Cannot track more than {self.ws_max_users} total users."})
+                        continue
+                    ip_users[user] = ip_users.get(user, 0) + 1
+                    self.ws_stats["acked"] += 1
+                    fills = self._fills(user)
+                    subscribed[user] = fills[-1]["tid"] if fills else 0
+                    await ws.send_json({"channel": "subscriptionResponse", "data": body})
+                    await ws.send_json({"channel": "userFills", "data": {"isSnapshot": True, "user": user, "fills": fills}})
+                elif body.get("method") == "unsubscribe" and user in subscribed:
+                    del subscribed[user]
+                    ip_users[user] -= 1
+                    if not ip_users[user]:
+                        del ip_users[user]
+                    await ws.send_json({"channel": "subscriptionResponse", "data": body})
+        finally:
+            pusher.cancel()
+            if closer is not None:
+                closer.cancel()
+            for user in subscribed:
+                ip_users[user] -= 1
+                if not ip_users[user]:
+                    del ip_users[user]
+        return ws
+
+    async def start(self, host: str, port: int):
+        app = web.Application()
+        app.add_routes([
+            web.post("/info", self.info),
+            web.get("/ws", self.ws),
+            web.get("/control", self.control),
+            web.post("/control", self.control),
+        ])
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+# -----------------------
+# Proceso del bot (un escenario)
+# -----------------------
+
+class FakeBot:
+    """
+    Sustituto de telegram.Bot: cuenta mensajes y simula la latencia de envío.
+    """
+
+    def __init__(self, send_latency: float):
+        self.send_latency = send_latency
+        self.messages = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if self.send_latency:
+            await asyncio.sleep(self.send_latency)
+        self.messages += 1
+        return SimpleNamespace(chat_id=chat_id, text=text, edit_text=self.edit_text)
+
+    async def edit_text(self, text, **kwargs):
+        if self.send_latency:
+            await asyncio.sleep(self.send_latency)
+
+def summary_update(bot: FakeBot, chat_id: int, period: int):
+    """
+    Update mínimo para llamar a summary_callback como si se pulsara un botón.
+    """
+    async def answer(*args, **kwargs):
+        pass
+
+    async def reply_text(text, **kwargs):
+        return await bot.send_message(chat_id, text)
+
+    query = SimpleNamespace(
+        data=f"summary_{period}",
+        from_user=SimpleNamespace(id=chat_id),
+        answer=answer,
+        edit_message_text=lambda text, **kwargs: bot.edit_text(text),
+        message=SimpleNamespace(reply_text=reply_text),
+    )
+    return SimpleNamespace(callback_query=query)
+
+def rss_mb() -> float:
+    """
+    Memoria residente actual en MB (pico si no hay /proc).
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+async def run_scenario(config: dict) -> dict:
+    import bot_hyperliquid as bot
+
+    logging.getLogger().setLevel(config["log_level"])
+    sink = FakeBot(config["send_latency"])
+    app = SimpleNamespace(bot=sink, create_task=asyncio.create_task)
+
+    if not config["telegram_limits"]:
+        # Solo se mide el bot: sin los límites de envío de Telegram
+        bot.alert_sender._global_bucket = bot.TokenBucket(1e9, 1e9)
+        bot.TELEGRAM_CHAT_RATE = 1e9
+
+    alert_delays = []
+    sweeps = []
+    # Se guarda el append de cada lista: los nombres se reasignan a copias más abajo
+    record_delay, record_sweep = alert_delays.append, sweeps.append
+    bot.ALERT_DELAY_SECONDS.observe = lambda value, **labels: record_delay(value)
+    bot.MONITOR_SWEEP_SECONDS.observe = lambda value, **labels: record_sweep(value)
+
+    wallets = config["wallets"]
+    per_chat = config["wallets_per_chat"]
+    rss_before = rss_mb()
+    for i in range(wallets):
+        chat_id = 1 + i // per_chat
+        bot.loaded_chats.add(chat_id)
+        bot.add_wallet(chat_id, f"0x{i:040x}", f"W{i}")
+    rss_loaded = rss_mb()
+
+    await bot.hl_client.start()
+    bot.alert_sender.start(sink)
+    cpu_started = time.process_time()
+    started = time.monotonic()
+    monitor = asyncio.create_task(bot.monitor_wallets(app))
+
+    # Primer barrido: todas las wallets están pendientes desde el arranque. Con
+    # pollers (POLLER_WORKERS) los barridos se miden en sus procesos y aquí no
+    # llega ninguno: se espera como mucho la duración del escenario
+    while not sweeps and not monitor.done() and time.monotonic() - started < config["duration"]:
+        await asyncio.sleep(0.01)
+    first_sweep = time.monotonic() - started if sweeps else None
+    remaining = config["duration"] - (time.monotonic() - started)
+    if remaining > 0:
+        await asyncio.sleep(remaining)
+    elapsed = time.monotonic() - started
+    # Copias: las alertas pendientes se siguen enviando durante /summary
+    live_delays = alert_delays
+    alert_delays = list(alert_delays)
+    sweeps = list(sweeps)
+    messages = sink.messages
+
+    # Entrega: sin fills nuevos, cada fill generado debe acabar en una alerta
+    # (hasta el siguiente sondeo de la wallet más lenta)
+    import aiohttp
+    async with aiohttp.ClientSession() as session:
+        async with session.post(f"{config['mock_url']}/control", json={"freeze": True}) as response:
+            generated = (await response.json())["fills_generated"]
+        deadline = time.monotonic() + config["settle"]
+        while len(live_delays) < generated and time.monotonic() < deadline and not monitor.done():
+            await asyncio.sleep(0.1)
+        delivered = len(live_delays)
+        await session.post(f"{config['mock_url']}/control", json={"freeze": False})
+    monitor.cancel()
+    await asyncio.gather(monitor, return_exceptions=True)
+    monitor_cpu = time.process_time() - cpu_started
+    rss_monitor = rss_mb()
+
+    # /summary de un chat con las primeras `summary_wallets` wallets, en frío
+    # (fill_store sin ese periodo) y en caliente
+    summary = {}
+    summary_chat = 0
+    bot.loaded_chats.add(summary_chat)
+    for i in range(min(wallets, config["summary_wallets"])):
+        bot.add_wallet(summary_chat, f"0x{i:040x}", f"W{i}")
+    for period in config["summary_periods"]:
+        runs = []
+        for _ in range(2):
+            t0 = time.monotonic()
+            await bot.summary_callback(summary_update(sink, summary_chat, period), None)
+            runs.append(round(time.monotonic() - t0, 4))
+        summary[str(period)] = {"cold_s": runs[0], "warm_s": runs[1]}
+
+    await bot.alert_sender.close()
+    await bot.hl_client.close()
+    return {
+        "wallets": wallets,
+        "chats": (wallets + per_chat - 1) // per_chat,
+        "duration_s": round(elapsed, 3),
+        "first_sweep_s": round(first_sweep, 4) if first_sweep is not None else None,
+        "sweep_s": distribution(sweeps),
+        "alerts": len(alert_delays),
+        "messages": messages,
+        "fills_generated": generated,
+        "alerts_delivered": delivered,
+        "missed_alerts": generated - delivered,
+        "alerts_per_s": round(len(alert_delays) / elapsed, 3) if elapsed else None,
+        "alert_latency_s": distribution(alert_delays),
+        "summary": summary,
+        "cpu_s": round(monitor_cpu, 3),
+        "cpu_percent": round(100 * monitor_cpu / elapsed, 1) if elapsed else None,
+        "rss_mb": {
+            "start": round(rss_before, 1),
+            "wallets_loaded": round(rss_loaded, 1),
+            "after_monitor": round(rss_monitor, 1),
+            "peak": round(max(rss_monitor, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024), 1),
+        },
+        "api_errors": {"/".join(key): value for key, value in bot.HL_API_ERRORS._values.items()},
+    }
+
+def child_main(config: dict):
+    """
+    Entrada del proceso hijo: el entorno del bot ya viene fijado por el padre.
+    """
+    result = asyncio.run(run_scenario(config))
+    print(json.dumps(result), flush=True)
+
+# -----------------------
+# Proceso principal
+# -----------------------
+
+def bot_environment(args) -> dict:
+    """
+    Entorno del bot para el benchmark; lo que ya esté definido se respeta.
+    """
+    env = dict(os.environ)
+    env.setdefault("TOKEN", "0:bench")
+    env.setdefault("STORAGE_BACKEND", "memory")
+    env.setdefault("HL_STREAMING", "1" if args.streaming else "0")
+    env["HL_WS_URL"] = f"ws://127.0.0.1:{args.port}/ws"
+    env.setdefault("POLLER_WORKERS", "0")
+    env["HL_API_URL"] = f"http://127.0.0.1:{args.port}"
+    env.setdefault("HL_MAX_CONCURRENCY", str(args.concurrency))
+    env.setdefault("MONITOR_INTERVAL", str(args.monitor_interval))
+    env.setdefault("POLL_MIN_INTERVAL", str(min(args.monitor_interval, 1)))
+    env.setdefault("POLL_MAX_INTERVAL", str(args.monitor_interval * 4))
+    if not args.weight_limit:
+        # Sin el límite de peso de Hyperliquid: se mide el bot, no el rate limit
+        env.setdefault("HL_WEIGHT_PER_MINUTE", str(10 ** 9))
+    return env
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+async def run_benchmark(args) -> dict:
+    mock = MockHyperliquid(
+        latency=args.latency / 1000,
+        jitter=args.jitter / 1000,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        fills_per_minute=args.fills_per_minute,
+        positions=args.positions,
+        ws_max_users=args.ws_max_users,
+        ws_disconnect_every=args.ws_disconnect_every,
+    )
+    runner = await mock.start("127.0.0.1", args.port)
+    env = bot_environment(args)
+    results = []
+    try:
+        for wallets in args.wallets:
+            mock.reset()
+            config = {
+                "wallets": wallets,
+                "wallets_per_chat": args.wallets_per_chat,
+                "duration": args.duration,
+                "summary_wallets": args.summary_wallets,
+                "summary_periods": args.summary_periods,
+                "send_latency": args.send_latency / 1000,
+                "telegram_limits": args.telegram_limits,
+                "log_level": args.log_level,
+                "mock_url": f"http://127.0.0.1:{args.port}",
+                # Lo que tarda en volver a consultarse una wallet inactiva, con margen
+                "settle": args.monitor_interval * 4 + 10,
+            }
+            proc = await asyncio.create_subprocess_exec(
+                sys.executable, os.path.abspath(__file__), "--child", json.dumps(config),
+                env=env, stdout=asyncio.subprocess.PIPE,
+            )
+            stdout, _ = await proc.communicate()
+            lines = stdout.decode().strip().splitlines()
+            if proc.returncode != 0 or not lines:
+                result = {"wallets": wallets, "error": f"exit code {proc.returncode}"}
+            else:
+                result = json.loads(lines[-1])
+            result["mock"] = mock.stats()
+            results.append(result)
+            logging.info(f"bench: {wallets} wallets -> {json.dumps(result)}")
+    finally:
+        await runner.cleanup()
+    return {
+        "revision": git_revision(),
+        "python": sys.version.split()[0],
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "config": {k: v for k, v in vars(args).items() if k not in ("child", "output")},
+        "results": results,
+    }
+
+def parse_args(argv=None):
+    ints = lambda value: [int(v) for v in value.split(",") if v]
+    parser = argparse.ArgumentParser(description="Benchmark de bot_hyperliquid con una API de Hyperliquid simulada")
+    parser.add_argument("--wallets", type=ints, default=[10, 100, 1000, 10000], help="wallets por escenario, separadas por comas")
+    parser.add_argument("--wallets-per-chat", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=60, help="segundos de monitor por escenario")
+    parser.add_argument("--monitor-interval", type=float, default=5, help="MONITOR_INTERVAL del bot")
+    parser.add_argument("--concurrency", type=int, default=8, help="HL_MAX_CONCURRENCY del bot")
+    parser.add_argument("--weight-limit", action="store_true", help="respetar el límite de peso real de la API")
+    parser.add_argument("--latency", type=float, default=50, help="latencia del mock en ms")
+    parser.add_argument("--jitter", type=float, default=20, help="latencia extra aleatoria del mock en ms")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fracción de peticiones que fallan")
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--fills-per-minute", type=float, default=2, help="fills nuevos por wallet y minuto")
+    parser.add_argument("--positions", type=int, default=3, help="posiciones por wallet en clearinghouseState")
+    parser.add_argument("--summary-wallets", type=int, default=100, help="wallets del chat usado para /summary")
+    parser.add_argument("--summary-periods", type=ints, default=[60, 1440])
+    parser.add_argument("--send-latency", type=float, default=0, help="latencia de envío a Telegram en ms")
+    parser.add_argument("--telegram-limits", action="store_true", help="respetar los límites de envío de Telegram")
+    parser.add_argument("--streaming", action="store_true", help="HL_STREAMING=1 contra el /ws del mock")
+    parser.add_argument("--ws-max-users", type=int, default=10, help="usuarios suscritos por IP que admite el mock")
+    parser.add_argument("--ws-disconnect-every", type=float, default=0, help="el mock cierra cada WebSocket pasados estos segundos (0 = nunca)")
+    parser.add_argument("--port", type=int, default=18980, help="puerto del mock")
+    parser.add_argument("--log-level", default="ERROR", help="nivel de log del bot")
+    parser.add_argument("--output", help="fichero JSON de resultados (por defecto stdout)")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+def failed_scenarios(report: dict) -> list:
+    """
+    Escenarios que fallan la comprobación: el hijo terminó con error o algún
+    fill generado no se alertó (missed_alerts > 0).
+    """
+    return [
+        result for result in report["results"]
+        if "error" in result or result.get("missed_alerts", 0) > 0
+    ]
+
+def main():
+    args = parse_args()
+    if args.child:
+        child_main(json.loads(args.child))
+        return
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    report = asyncio.run(run_benchmark(args))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    failed = failed_scenarios(report)
+    for result in failed:
+        logging.error(f"bench: {result['wallets']} wallets: {result.get('error') or str(result['missed_alerts']) + ' alertas perdidas'}")
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,21 @@
 import logging
 import aiohttp
+import contextvars
+import functools
 import os
+import hashlib
+import hmac
+import html
+import json
+import multiprocessing
+import queue
+import random
+import signal
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
 from aiohttp import web
 from datetime import datetime, timedelta
 from telegram import (
@@ -10,6 +25,7 @@ from telegram import (
     BotCommand,
     MenuButtonCommands
 )
+from telegram.error import BadRequest, Forbidden, RetryAfter
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
@@ -20,6 +36,32 @@ from telegram.ext import (
     Application
 )
 import asyncio
+import bisect
+import heapq
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from itertools import accumulate
+
+# Decodificador JSON de las respuestas de Hyperliquid: orjson o msgspec si están
+# instalados (varias veces más rápidos con miles de fills), si no json estándar
+try:
+    import orjson
+    json_loads = orjson.loads
+    JSONDecodeError = orjson.JSONDecodeError
+except ImportError:
+    try:
+        import msgspec
+        json_loads = msgspec.json.decode
+        JSONDecodeError = msgspec.DecodeError
+    except ImportError:
+        json_loads = json.loads
+        JSONDecodeError = json.JSONDecodeError
+
+# numpy (opcional) para las columnas del motor de /summary; sin él se usa array
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 # -----------------------
 # Configuración inicial
@@ -31,62 +73,1738 @@ if not TOKEN:
 
 logging.basicConfig(level=logging.INFO)
 
+# Cliente HTTP de Hyperliquid (pool keep-alive compartido)
+HL_API_URL = os.getenv("HL_API_URL", "https://api.hyperliquid.xyz")
+HL_POOL_LIMIT = int(os.getenv("HL_POOL_LIMIT", "100"))
+HL_POOL_LIMIT_PER_HOST = int(os.getenv("HL_POOL_LIMIT_PER_HOST", "50"))
+HL_KEEPALIVE_TIMEOUT = float(os.getenv("HL_KEEPALIVE_TIMEOUT", "60"))
+HL_REQUEST_TIMEOUT = float(os.getenv("HL_REQUEST_TIMEOUT", "10"))
+
+# Reintentos ante 429/5xx/errores de red (backoff exponencial con jitter) y
+# circuit breaker: tras BREAKER_FAILURE_THRESHOLD fallos seguidos se dejan de
+# hacer peticiones durante BREAKER_RESET_TIMEOUT segundos. Un Retry-After de
+# más de HL_RETRY_MAX_DELAY segundos se acorta (pollers) o no se espera (bot)
+HL_MAX_RETRIES = int(os.getenv("HL_MAX_RETRIES", "3"))
+HL_RETRY_BASE_DELAY = 0.5
+HL_RETRY_MAX_DELAY = float(os.getenv("HL_RETRY_MAX_DELAY", "30"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+
+# Límite de peso de la API (1200 por minuto y por IP) y peticiones simultáneas
+HL_WEIGHT_PER_MINUTE = int(os.getenv("HL_WEIGHT_PER_MINUTE", "1200"))
+HL_MAX_CONCURRENCY = int(os.getenv("HL_MAX_CONCURRENCY", "8"))
+
+# Intervalo entre barridos de monitor_wallets (segundos)
+MONITOR_INTERVAL = float(os.getenv("MONITOR_INTERVAL", "20"))
+
+# /summary: las wallets se consultan en paralelo; con al menos
+# SUMMARY_PROGRESS_MIN_WALLETS se muestra un mensaje de progreso que se edita
+# como mucho cada SUMMARY_PROGRESS_EDIT_INTERVAL segundos
+SUMMARY_PROGRESS_MIN_WALLETS = int(os.getenv("SUMMARY_PROGRESS_MIN_WALLETS", "5"))
+SUMMARY_PROGRESS_EDIT_INTERVAL = 1.0
+# Ventanas de /summary (minutos): se calculan todas a la vez
+SUMMARY_WINDOWS = (60, 360, 720, 1440)
+# Páginas de userFillsByTime por wallet y pulsación de /summary (cada página
+# llena pesa ~120); la historia que no cabe se completa en las siguientes
+SUMMARY_SYNC_MAX_PAGES = int(os.getenv("SUMMARY_SYNC_MAX_PAGES", "3"))
+# Resúmenes memorizados (conjuntos de wallets distintos)
+SUMMARY_MEMO_MAX_ENTRIES = 1000
+
+# Intervalo adaptativo por wallet: baja hasta POLL_MIN_INTERVAL con actividad,
+# sube hasta POLL_MAX_INTERVAL sin ella. Una wallet abierta en /positions se
+# consulta al mínimo durante POLL_BOOST_SECONDS
+POLL_MIN_INTERVAL = float(os.getenv("POLL_MIN_INTERVAL", "5"))
+POLL_MAX_INTERVAL = float(os.getenv("POLL_MAX_INTERVAL", "300"))
+POLL_BOOST_SECONDS = float(os.getenv("POLL_BOOST_SECONDS", "120"))
+
+# Ventana de alertas para una dirección recién seguida (minutos)
+ALERT_LOOKBACK_MINUTES = 10
+# userFillsByTime devuelve como máximo 2000 fills por petición
+HL_FILLS_PAGE_SIZE = 2000
+
+# Modo streaming: fills por WebSocket (userFills) en lugar de sondear por REST
+HL_STREAMING = os.getenv("HL_STREAMING", "0") == "1"
+HL_WS_URL = os.getenv("HL_WS_URL", "wss://api.hyperliquid.xyz/ws")
+# Hyperliquid admite como mucho 10 usuarios distintos en suscripciones por
+# usuario (userFills) por IP, sumando todas las conexiones: el resto de
+# direcciones, y las que el servidor no confirme, se consultan por REST
+HL_WS_MAX_USERS = int(os.getenv("HL_WS_MAX_USERS", "10"))
+WS_MAX_USERS_PER_CONN = int(os.getenv("WS_MAX_USERS_PER_CONN", "10"))
+# El servidor cierra conexiones sin tráfico en 60s
+WS_PING_INTERVAL = 50
+WS_RECONNECT_MAX_DELAY = 60
+
+# Almacén de fills por dirección que mantiene el monitor y usa /summary
+FILL_STORE_RETENTION_MINUTES = int(os.getenv("FILL_STORE_RETENTION_MINUTES", "1440"))
+FILL_STORE_MAX_ADDRESSES = int(os.getenv("FILL_STORE_MAX_ADDRESSES", "2000"))
+FILL_STORE_MAX_FILLS_PER_ADDRESS = int(os.getenv("FILL_STORE_MAX_FILLS_PER_ADDRESS", "5000"))
+# Fills en total (~200 bytes cada uno con su id): acota la memoria en un plan pequeño
+FILL_STORE_MAX_FILLS = int(os.getenv("FILL_STORE_MAX_FILLS", "500000"))
+# Cada cuántos segundos se recorre el almacén entero para aplicar la retención
+# y soltar las direcciones que ya no sigue nadie
+FILL_STORE_PRUNE_INTERVAL = 300
+
+# Caché de clearinghouseState para /positions (segundos de validez)
+POSITIONS_CACHE_TTL = float(os.getenv("POSITIONS_CACHE_TTL", "5"))
+POSITIONS_CACHE_MAX_ENTRIES = 10000
+# Vista "todas las wallets" de /positions: se guarda por chat para paginar sin
+# volver a consultar la API (segundos de validez y número de chats)
+POSITIONS_VIEW_TTL = 600
+POSITIONS_VIEW_MAX_CHATS = 1000
+
+# Persistencia de wallets, estados y marcas de agua: "sqlite" o "memory"
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite")
+DB_PATH = os.getenv("DB_PATH", "bot_hyperliquid.db")
+# Las escrituras se agrupan y se confirman en un solo commit cada STORAGE_FLUSH_INTERVAL s
+STORAGE_FLUSH_INTERVAL = 0.5
+# Filas por lote al cargar las suscripciones en segundo plano
+STORAGE_LOAD_CHUNK = 1000
+
+# Cola de envío de alertas: límites de Telegram (30 msg/s en total, ~1 msg/s por chat)
+TELEGRAM_GLOBAL_RATE = 30
+TELEGRAM_CHAT_RATE = 1
+TELEGRAM_MAX_MESSAGE_LENGTH = 4096
+ALERT_SEND_WORKERS = int(os.getenv("ALERT_SEND_WORKERS", "4"))
+# Las alertas de un chat que llegan dentro de esta ventana (s) se envían en un solo mensaje
+ALERT_BATCH_WINDOW = float(os.getenv("ALERT_BATCH_WINDOW", "1.0"))
+ALERT_MAX_RETRIES = 5
+# Al apagar se espera como mucho este tiempo (s) a que se envíen las alertas en cola
+ALERT_DRAIN_TIMEOUT = float(os.getenv("ALERT_DRAIN_TIMEOUT", "10"))
+
+# Modo sharding: POLLER_WORKERS procesos sondean las direcciones, repartidas por
+# hashing consistente, y envían los fills a este proceso (0 = sondeo en proceso)
+POLLER_WORKERS = int(os.getenv("POLLER_WORKERS", "0"))
+# Peso de API por minuto de cada poller; por defecto se reparte el límite de la IP
+# entre los pollers y este proceso
+POLLER_WEIGHT_PER_MINUTE = int(os.getenv(
+    "POLLER_WEIGHT_PER_MINUTE", str(HL_WEIGHT_PER_MINUTE // (POLLER_WORKERS + 1))
+))
+# Peso de API por minuto de este proceso: con pollers, lo que dejan libre, para
+# que entre todos no pasen de HL_WEIGHT_PER_MINUTE
+BOT_WEIGHT_PER_MINUTE = HL_WEIGHT_PER_MINUTE
+if POLLER_WORKERS > 0:
+    BOT_WEIGHT_PER_MINUTE = HL_WEIGHT_PER_MINUTE - POLLER_WORKERS * POLLER_WEIGHT_PER_MINUTE
+    if BOT_WEIGHT_PER_MINUTE < 60:
+        logging.warning(
+            f"POLLER_WEIGHT_PER_MINUTE={POLLER_WEIGHT_PER_MINUTE} x {POLLER_WORKERS} pollers deja "
+            f"{BOT_WEIGHT_PER_MINUTE} de peso al bot; se usa 60"
+        )
+        BOT_WEIGHT_PER_MINUTE = 60
+HASH_RING_REPLICAS = 100
+
+# Watchdog del monitor: se reinicia si la tarea muere o no progresa en
+# MONITOR_STALL_SECONDS; /healthz responde 503 en ese caso
+MONITOR_STALL_SECONDS = float(os.getenv("MONITOR_STALL_SECONDS", str(max(120, 6 * MONITOR_INTERVAL))))
+WATCHDOG_INTERVAL = 30
+
+# Memoria de fills ya alertados: se olvidan pasados DEDUP_TTL_MINUTES y nunca
+# se guardan más de DEDUP_MAX_ENTRIES
+DEDUP_TTL_MINUTES = int(os.getenv("DEDUP_TTL_MINUTES", "60"))
+DEDUP_MAX_ENTRIES = int(os.getenv("DEDUP_MAX_ENTRIES", "100000"))
+# Cada cuántos segundos se registran en el log las estadísticas de deduplicación
+DEDUP_STATS_INTERVAL = 3600
+
+# Modo webhook: si WEBHOOK_URL (URL pública del servicio) está definida, Telegram
+# envía los updates a WEBHOOK_URL + WEBHOOK_PATH en el servidor aiohttp en vez de
+# usar long polling
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+# Secreto que Telegram manda en la cabecera X-Telegram-Bot-Api-Secret-Token; por
+# defecto se deriva del token para que no cambie entre reinicios
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or hashlib.sha256(TOKEN.encode()).hexdigest()
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+# Trazas: "" (desactivadas), "log" (un JSON por span en el log) u "otel"
+# (API de OpenTelemetry, p. ej. lanzando el bot con opentelemetry-instrument).
+# En modo log solo se escriben los spans de al menos TRACE_MIN_MS milisegundos
+TRACING = os.getenv("TRACING", "").lower()
+TRACE_MIN_MS = float(os.getenv("TRACE_MIN_MS", "0"))
+# Token de administración para /debug/profile (sin él la ruta no existe)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+PROFILE_MAX_SECONDS = 60
+PROFILE_INTERVAL = 0.005
+
 # user_data: { chat_id: [ {"address": "...", "name": "..."} , ... ] }
 user_data = {}
 
+# subscribers: índice inverso de user_data para consultar cada dirección una sola vez
+# { address: { chat_id: name } }
+# Se mantiene con add_wallet / remove_wallet / rename_wallet.
+subscribers = {}
+
 # user_states para los flujos de /add, /remove, /edit:
 # { chat_id: {"stage": "...", "address": "..."} }
+# Se modifica con set_state / clear_state para que quede persistido.
 user_states = {}
 
-# latest_fills para evitar alertas duplicadas: { "address-time": True }
-latest_fills = {}
+# Chats cuyas wallets y estado ya están en memoria (ver load_chat)
+loaded_chats = set()
+
+# Estado del monitor para /healthz, /readyz y el watchdog (timestamps en epoch s)
+monitor_status = {
+    "task": None,
+    "watchdog": None,
+    "started_at": None,
+    "last_sweep_at": None,
+    "last_progress_at": None,
+    "restarts": 0,
+    "subscriptions_loaded": False,
+}
+
+# Estado del webhook de Telegram (solo en modo webhook)
+webhook_status = {
+    "registered": False,
+    "last_update_at": None,
+}
+
+# fill_cursors: marca de agua del último fill alertado por dirección
+# { address: {"time": ms, "tids": {tid, ...}} }  (tids = fills de ese mismo ms)
+fill_cursors = {}
+
+# -----------------------
+# Métricas (formato Prometheus)
+# -----------------------
+
+class Metric:
+    """
+    Métrica con etiquetas en formato de exposición de Prometheus.
+    `func` permite leer el valor en el momento del scrape (sin etiquetas).
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labelnames=(), func=None):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.func = func
+        self._values = {}
+        METRICS.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _labels(self, key: tuple, extra: str = "") -> str:
+        pairs = [f'{name}="{value}"' for name, value in zip(self.labelnames, key)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        if self.func is not None:
+            lines.append(f"{self.name} {self.func()}")
+        for key, value in self._values.items():
+            lines.append(f"{self.name}{self._labels(key)} {value}")
+        return lines
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        series = self._values.get(key)
+        if series is None:
+            # counts[i]: observaciones en (buckets[i-1], buckets[i]]; la última, > buckets[-1]
+            series = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0}
+            self._values[key] = series
+        series["counts"][bisect.bisect_left(self.buckets, value)] += 1
+        series["sum"] += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, series in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series["counts"]):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{self._labels(key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._labels(key)} {series['sum']}")
+            lines.append(f"{self.name}_count{self._labels(key)} {cumulative}")
+        return lines
+
+METRICS = []
+
+def render_metrics() -> str:
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+HL_REQUEST_SECONDS = Histogram(
+    "hl_request_duration_seconds", "Latencia de las peticiones /info de Hyperliquid", LATENCY_BUCKETS, ["type"]
+)
+HL_API_ERRORS = Counter("hl_api_errors_total", "Peticiones /info fallidas", ["type", "reason"])
+MONITOR_SWEEP_SECONDS = Histogram(
+    "monitor_sweep_duration_seconds", "Duración de cada barrido del monitor",
+    (0.1, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300),
+)
+ALERT_DELAY_SECONDS = Histogram(
+    "alert_delay_seconds", "Retraso entre el time del fill y el envío de la alerta",
+    (0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300, 600),
+)
+Counter("dedup_hits_total", "Fills descartados por estar ya alertados", func=lambda: latest_fills.hits)
+Counter("dedup_evictions_total", "Fills olvidados por la deduplicación",
+        func=lambda: latest_fills.evicted_expired + latest_fills.evicted_overflow)
+Counter("telegram_messages_sent_total", "Mensajes de alerta enviados", func=lambda: alert_sender.sent)
+Counter("telegram_send_failures_total", "Mensajes de alerta perdidos tras los reintentos", func=lambda: alert_sender.failed)
+WEBHOOK_UPDATES = Counter("telegram_webhook_updates_total", "Peticiones recibidas en el webhook", ["result"])
+Gauge("tracked_addresses", "Direcciones distintas seguidas", func=lambda: len(subscribers))
+Gauge("tracked_wallets", "Wallets seguidas (chat, dirección)", func=lambda: sum(len(c) for c in subscribers.values()))
+Gauge("alert_queue_depth", "Alertas pendientes de enviar", func=lambda: alert_sender.qsize())
+Gauge("dedup_entries", "Fills en la memoria de deduplicación", func=lambda: len(latest_fills))
+Gauge("fill_store_addresses", "Direcciones en fill_store", func=lambda: len(fill_store))
+Gauge("fill_store_fills", "Fills en fill_store", func=lambda: fill_store.fill_count())
+Gauge("positions_cache_entries", "Entradas en positions_cache", func=lambda: len(positions_cache))
+Gauge("summary_memo_entries", "Resúmenes memorizados en summary_engine", func=lambda: len(summary_engine._memo))
+Gauge("hl_circuit_open", "1 si el circuit breaker de la API no está cerrado", func=lambda: int(not hl_client.breaker.closed))
+
+# -----------------------
+# Trazas y perfilado
+# -----------------------
+
+class NoopSpan:
+    """
+    Span vacío que devuelve span() con las trazas desactivadas.
+    """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set_attribute(self, key: str, value):
+        pass
+
+NOOP_SPAN = NoopSpan()
+
+# Span activo de la tarea actual (padre de los que se abran dentro)
+current_span = contextvars.ContextVar("current_span", default=None)
+trace_logger = logging.getLogger("bot_hyperliquid.trace")
+
+class LogSpan:
+    """
+    Span del modo log: al cerrarse escribe una línea JSON con los campos de un
+    span de OpenTelemetry (trace_id, span_id, parent_span_id, tiempos en ns,
+    atributos y estado). Los spans hijos heredan el trace_id vía contextvars,
+    también entre las tareas creadas dentro.
+    """
+
+    __slots__ = ("name", "attributes", "trace_id", "span_id", "parent_span_id", "start_ns", "_started", "_token")
+
+    def __init__(self, name: str, attributes: dict):
+        parent = current_span.get()
+        self.name = name
+        self.attributes = attributes
+        self.trace_id = parent.trace_id if parent is not None else f"{random.getrandbits(128):032x}"
+        self.parent_span_id = parent.span_id if parent is not None else None
+        self.span_id = f"{random.getrandbits(64):016x}"
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def __enter__(self):
+        self._token = current_span.set(self)
+        self.start_ns = time.time_ns()
+        self._started = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration_ns = time.perf_counter_ns() - self._started
+        current_span.reset(self._token)
+        if duration_ns >= TRACE_MIN_MS * 1_000_000 or exc_type is not None:
+            record = {
+                "name": self.name,
+                "trace_id": self.trace_id,
+                "span_id": self.span_id,
+                "parent_span_id": self.parent_span_id,
+                "start_time_unix_nano": self.start_ns,
+                "end_time_unix_nano": self.start_ns + duration_ns,
+                "duration_ms": round(duration_ns / 1_000_000, 3),
+                "attributes": self.attributes,
+                "status": "ERROR" if exc_type is not None else "OK",
+            }
+            if exc_type is not None:
+                record["exception"] = repr(exc)
+            trace_logger.info(json.dumps(record, default=str))
+        return False
+
+otel_tracer = None
+if TRACING == "otel":
+    try:
+        from opentelemetry import trace as otel_trace
+        otel_tracer = otel_trace.get_tracer("bot_hyperliquid")
+    except ImportError:
+        logging.warning("TRACING=otel pero opentelemetry no está instalado; se usa TRACING=log")
+        TRACING = "log"
+elif TRACING not in ("", "log"):
+    logging.warning(f"TRACING={TRACING} no reconocido; trazas desactivadas")
+    TRACING = ""
+
+def span(name: str, **attributes):
+    """
+    Context manager de un span de traza. Con las trazas desactivadas devuelve
+    NOOP_SPAN, así el coste en el camino caliente es una llamada.
+    """
+    if not TRACING:
+        return NOOP_SPAN
+    if otel_tracer is not None:
+        return otel_tracer.start_as_current_span(name, attributes=attributes)
+    return LogSpan(name, attributes)
+
+def traced(name: str):
+    """
+    Decorador que envuelve una corrutina (p. ej. un handler de Telegram) en un
+    span. Con las trazas desactivadas devuelve la función sin tocar.
+    """
+    def decorator(func):
+        if not TRACING:
+            return func
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def folded_stack(frame) -> str:
+    """
+    Pila de frame en formato "folded" (raíz;...;hoja) para flamegraph.pl o speedscope.
+    """
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+def sample_stacks(thread_id: int, seconds: float, interval: float = PROFILE_INTERVAL) -> dict:
+    """
+    Perfilador por muestreo desde otro hilo: cada `interval` segundos toma la
+    pila del hilo thread_id y cuenta cuántas veces aparece cada una. Sesgado
+    hacia los puntos donde el hilo suelta el GIL (p. ej. select), por eso solo
+    se usa cuando no hay SIGPROF.
+    """
+    counts = {}
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        if frame is not None:
+            key = folded_stack(frame)
+            counts[key] = counts.get(key, 0) + 1
+        time.sleep(interval)
+    return counts
+
+async def profile_event_loop(seconds: float, interval: float = PROFILE_INTERVAL) -> dict:
+    """
+    Perfila el event loop durante `seconds`. Con setitimer(ITIMER_PROF) el
+    handler de SIGPROF recibe el frame que se estaba ejecutando cada `interval`
+    segundos de CPU, sin el sesgo del muestreo desde otro hilo; el tiempo
+    ocioso no genera muestras. Sin SIGPROF (Windows) o fuera del hilo
+    principal se usa sample_stacks en un hilo aparte.
+    """
+    loop = asyncio.get_running_loop()
+    if not hasattr(signal, "setitimer") or threading.current_thread() is not threading.main_thread():
+        return await loop.run_in_executor(None, sample_stacks, threading.get_ident(), seconds, interval)
+    counts = {}
+
+    def on_sigprof(signum, frame):
+        key = folded_stack(frame)
+        counts[key] = counts.get(key, 0) + 1
+
+    previous = signal.signal(signal.SIGPROF, on_sigprof)
+    signal.setitimer(signal.ITIMER_PROF, interval, interval)
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, previous)
+    return counts
+
+# Un solo perfil a la vez
+profile_lock = asyncio.Lock()
+
+# -----------------------
+# Cliente Hyperliquid
+# -----------------------
+
+class HyperliquidError(Exception):
+    """
+    Error base de las llamadas a la API de Hyperliquid.
+    """
+
+class HyperliquidHTTPError(HyperliquidError):
+    """
+    La API respondió con un código HTTP distinto de 200.
+    """
+    def __init__(self, status: int, request_type: str, retry_after: float = None):
+        super().__init__(f"HTTP {status} en {request_type}")
+        self.status = status
+        self.retry_after = retry_after
+
+class HyperliquidResponseError(HyperliquidError):
+    """
+    La API respondió algo que no es JSON.
+    """
+
+class HyperliquidUnavailable(HyperliquidError):
+    """
+    El circuit breaker está abierto: no se llama a la API hasta que pase el tiempo de espera.
+    """
+
+class CircuitBreaker:
+    """
+    Circuit breaker de la API. Tras `failure_threshold` peticiones fallidas
+    seguidas se abre y rechaza las peticiones durante `reset_timeout` segundos;
+    después deja pasar una petición de prueba (half_open) que lo cierra si va bien
+    o lo vuelve a abrir si falla.
+    """
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_started = None
+
+    @property
+    def closed(self) -> bool:
+        return self.state == "closed"
+
+    def retry_in(self) -> float:
+        """
+        Segundos hasta que se permita la petición de prueba.
+        """
+        if self.state == "closed":
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        now = time.monotonic()
+        if self.state == "open":
+            if now < self.opened_at + self.reset_timeout:
+                return False
+            self.state = "half_open"
+            self._probe_started = None
+        # half_open: una sola petición de prueba a la vez (si se pierde, otra tras reset_timeout)
+        if self._probe_started is None or now - self._probe_started > self.reset_timeout:
+            self._probe_started = now
+            return True
+        return False
+
+    def record_success(self):
+        if self.state != "closed":
+            logging.info("CircuitBreaker: API recuperada, se cierra el circuito")
+        self.state = "closed"
+        self.failures = 0
+        self._probe_started = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+            logging.warning(f"CircuitBreaker: {self.failures} fallos seguidos, se abre el circuito {self.reset_timeout:.0f}s")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self._probe_started = None
+
+# Peso de cada tipo de petición /info según la documentación de Hyperliquid.
+# Los tipos de fills suman además 1 de peso por cada 20 elementos devueltos.
+INFO_WEIGHTS = {
+    "clearinghouseState": 2,
+    "allMids": 2,
+    "userFills": 20,
+    "userFillsByTime": 20,
+}
+INFO_ITEMS_PER_WEIGHT = 20
+
+class TokenBucket:
+    """
+    Token bucket asíncrono: `rate` tokens por segundo hasta un máximo de `capacity`.
+    acquire() espera hasta que haya tokens suficientes.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, tokens: float = 1):
+        tokens = min(tokens, self.capacity)
+        async with self._lock:
+            self._refill()
+            while self.tokens < tokens:
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= tokens
+
+    def charge(self, tokens: float):
+        """
+        Descuenta tokens sin esperar (peso conocido tras la respuesta).
+        El saldo puede quedar negativo y retrasa las siguientes peticiones.
+        """
+        self._refill()
+        self.tokens -= tokens
+
+class Fill:
+    """
+    Fill de Hyperliquid reducido a los campos que usa el bot, sin el dict
+    completo de la API. px y sz se convierten a float una sola vez y time son
+    ms epoch (int), con lo que se ordena y se filtra por ventana.
+    """
+
+    __slots__ = ("coin", "px", "sz", "side", "time", "tid", "dir", "hash")
+
+    def __init__(self, coin: str, px: float, sz: float, side: str, time: int, tid=None, dir: str = "", hash: str = None):
+        self.coin = coin
+        self.px = px
+        self.sz = sz
+        self.side = side
+        self.time = time
+        self.tid = tid
+        self.dir = dir
+        self.hash = hash
+
+    def __repr__(self):
+        return f"Fill({self.coin} {self.side} {self.sz}@{self.px} t={self.time} tid={self.tid})"
+
+def parse_fills(raw_fills: list) -> list:
+    """
+    Convierte los fills de la API (userFills, userFillsByTime o WebSocket) en Fill.
+    """
+    try:
+        with span("hl.parse_fills", fills=len(raw_fills)):
+            return [
+                Fill(raw["coin"], float(raw["px"]), float(raw["sz"]), raw["side"], raw["time"],
+                     raw.get("tid"), raw.get("dir", ""), raw.get("hash"))
+                for raw in raw_fills
+            ]
+    except (KeyError, TypeError, ValueError) as e:
+        raise HyperliquidResponseError(f"fill con formato inesperado: {e!r}")
+
+class HyperliquidClient:
+    """
+    Cliente compartido para el endpoint /info de Hyperliquid.
+    Reutiliza una única aiohttp.ClientSession con pool de conexiones keep-alive,
+    así cada petición evita un nuevo handshake TCP+TLS.
+    Se abre en on_startup y se cierra en on_shutdown.
+    """
+
+    def __init__(
+        self,
+        base_url: str = HL_API_URL,
+        limit: int = HL_POOL_LIMIT,
+        limit_per_host: int = HL_POOL_LIMIT_PER_HOST,
+        keepalive_timeout: float = HL_KEEPALIVE_TIMEOUT,
+        request_timeout: float = HL_REQUEST_TIMEOUT,
+        weight_per_minute: int = HL_WEIGHT_PER_MINUTE,
+        max_retries: int = HL_MAX_RETRIES,
+        fail_fast: bool = False,
+    ):
+        self.info_url = base_url.rstrip("/") + "/info"
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.request_timeout = request_timeout
+        self.limiter = TokenBucket(weight_per_minute / 60, weight_per_minute)
+        self.max_retries = max_retries
+        self.fail_fast = fail_fast
+        self.breaker = CircuitBreaker()
+        self._session = None
+
+    async def start(self):
+        if self._session is not None and not self._session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=300,
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.request_timeout),
+        )
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def ws_connect(self, url: str, **kwargs):
+        """
+        Abre un WebSocket reutilizando la sesión (y el pool) del cliente.
+        """
+        if self._session is None or self._session.closed:
+            await self.start()
+        return await self._session.ws_connect(url, **kwargs)
+
+    async def _post_info(self, payload: dict, timeout: float = None):
+        """
+        Hace POST a /info y devuelve el JSON decodificado, respetando el límite de peso.
+        Reintenta los 429, 5xx, respuestas no JSON y errores de red hasta max_retries
+        veces con backoff exponencial con jitter (o lo que diga Retry-After, como
+        mucho HL_RETRY_MAX_DELAY). Con fail_fast, si Retry-After pide esperar más
+        que eso no se espera: se lanza el error para que quien llama muestre los
+        últimos datos buenos en vez de dejar al usuario esperando.
+        Lanza HyperliquidUnavailable si el circuit breaker está abierto y
+        HyperliquidHTTPError / HyperliquidResponseError si la respuesta no es válida.
+        """
+        request_type = payload["type"]
+        if not self.breaker.allow():
+            HL_API_ERRORS.inc(type=request_type, reason="circuit_open")
+            raise HyperliquidUnavailable(
+                f"API no disponible, reintento en {self.breaker.retry_in():.0f}s ({request_type})"
+            )
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                data = await self._post_once(payload, timeout)
+            except HyperliquidHTTPError as e:
+                HL_API_ERRORS.inc(type=request_type, reason=f"http_{e.status}")
+                if e.status != 429 and e.status < 500:
+                    # Error de la petición, no de la API: no se reintenta
+                    self.breaker.record_success()
+                    raise
+                error = e
+                retry_after = e.retry_after
+            except (HyperliquidResponseError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                HL_API_ERRORS.inc(type=request_type, reason=type(e).__name__)
+                error = e
+            else:
+                self.breaker.record_success()
+                return data
+            if attempt == self.max_retries:
+                break
+            if retry_after is None:
+                retry_after = random.uniform(0, min(HL_RETRY_MAX_DELAY, HL_RETRY_BASE_DELAY * 2 ** attempt))
+            elif retry_after > HL_RETRY_MAX_DELAY:
+                if self.fail_fast:
+                    logging.warning(f"HyperliquidClient: {request_type} falló ({error!r}), Retry-After {retry_after:.0f}s, no se reintenta")
+                    break
+                retry_after = HL_RETRY_MAX_DELAY
+            logging.warning(f"HyperliquidClient: {request_type} falló ({error!r}), reintento en {retry_after:.1f}s")
+            await asyncio.sleep(retry_after)
+        self.breaker.record_failure()
+        raise error
+
+    async def _post_once(self, payload: dict, timeout: float = None):
+        if self._session is None or self._session.closed:
+            await self.start()
+        request_type = payload["type"]
+        await self.limiter.acquire(INFO_WEIGHTS.get(request_type, 20))
+        kwargs = {}
+        if timeout is not None:
+            kwargs["timeout"] = aiohttp.ClientTimeout(total=timeout)
+        started = time.monotonic()
+        try:
+            with span("hl.request", type=request_type):
+                return await self._request(payload, request_type, kwargs)
+        finally:
+            HL_REQUEST_SECONDS.observe(time.monotonic() - started, type=request_type)
+
+    async def _request(self, payload: dict, request_type: str, kwargs: dict):
+        async with self._session.post(self.info_url, json=payload, **kwargs) as resp:
+            if resp.status != 200:
+                retry_after = resp.headers.get("Retry-After", "")
+                raise HyperliquidHTTPError(
+                    resp.status,
+                    request_type,
+                    float(retry_after) if retry_after.isdigit() else None,
+                )
+            content_type = resp.headers.get("Content-Type", "")
+            if "application/json" not in content_type:
+                text = await resp.text()
+                raise HyperliquidResponseError(f"respuesta no JSON ({content_type}): {text}")
+            body = await resp.read()
+        try:
+            with span("hl.decode", type=request_type, bytes=len(body)):
+                return json_loads(body)
+        except JSONDecodeError as e:
+            raise HyperliquidResponseError(f"JSON inválido: {e}")
+
+    async def user_fills(self, address: str, timeout: float = None) -> list:
+        """
+        userFills: fills más recientes de la dirección.
+        Se adapta si la respuesta viene como lista o como dict.
+        """
+        data = await self._post_info({"type": "userFills", "user": address}, timeout=timeout)
+        if isinstance(data, list):
+            fills = data
+        else:
+            fills = data.get("userFills", {}).get("fills", [])
+        self.limiter.charge(len(fills) // INFO_ITEMS_PER_WEIGHT)
+        return parse_fills(fills)
+
+    async def user_fills_by_time(self, address: str, start_time: int, end_time: int = None, timeout: float = None) -> list:
+        """
+        userFillsByTime: fills con time >= start_time (ms), y <= end_time si se indica.
+        Devuelve como máximo HL_FILLS_PAGE_SIZE fills.
+        """
+        payload = {"type": "userFillsByTime", "user": address, "startTime": start_time}
+        if end_time is not None:
+            payload["endTime"] = end_time
+        fills = await self._post_info(payload, timeout=timeout) or []
+        self.limiter.charge(len(fills) // INFO_ITEMS_PER_WEIGHT)
+        return parse_fills(fills)
+
+    async def clearinghouse_state(self, address: str, timeout: float = None) -> dict:
+        """
+        clearinghouseState: posiciones abiertas y márgenes de la dirección.
+        """
+        return await self._post_info({"type": "clearinghouseState", "user": address}, timeout=timeout)
+
+    async def all_mids(self, timeout: float = None) -> dict:
+        """
+        allMids: precio medio actual de cada moneda, { coin: "px" }.
+        """
+        return await self._post_info({"type": "allMids"}, timeout=timeout)
+
+# hl_client: cliente del bot; atiende a usuarios, así que no espera Retry-After largos
+hl_client = HyperliquidClient(weight_per_minute=BOT_WEIGHT_PER_MINUTE, fail_fast=True)
 
 # -----------------------
 # Funciones auxiliares
 # -----------------------
 
-async def fetch_fills(address: str, timeframe_minutes: int):
+class CoalescingCache:
     """
-    Llama al endpoint userFills de Hyperliquid y filtra operaciones
-    realizadas en los últimos timeframe_minutes.
-    Se adapta si la respuesta viene como lista o como dict.
+    Caché con TTL por clave. Si varias tareas piden a la vez una clave que no
+    está (o ha caducado) se hace una sola carga y todas esperan su resultado.
+    get() devuelve (valor, timestamp de la carga) para poder mostrar su antigüedad.
+    Las entradas caducadas se conservan (hasta max_entries) para peek(): sirven
+    de último dato bueno si la API falla.
     """
-    url = "https://api.hyperliquid.xyz/info"
-    payload = {"type": "userFills", "user": address}
-    async with aiohttp.ClientSession() as session:
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # { key: (fetched_at, value) }
+        self._entries = OrderedDict()
+        self._inflight = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def get(self, key, loader):
+        """
+        Devuelve (valor, fetched_at); si hace falta carga el valor con `await loader()`.
+        """
+        entry = self._entries.get(key)
+        if entry is not None and time.time() - entry[0] < self.ttl:
+            return entry[1], entry[0]
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._load(key, loader))
+            self._inflight[key] = future
+        # shield: si se cancela quien espera, la carga sigue para el resto
+        return await asyncio.shield(future)
+
+    def peek(self, key):
+        """
+        Último valor cargado aunque haya caducado: (valor, fetched_at) o None.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        return entry[1], entry[0]
+
+    async def _load(self, key, loader):
         try:
-            async with session.post(url, json=payload) as resp:
-                if resp.status != 200:
-                    logging.error(f"fetch_fills: HTTP {resp.status} para dirección {address}")
-                    return []
-                content_type = resp.headers.get("Content-Type", "")
-                if "application/json" not in content_type:
-                    text = await resp.text()
-                    logging.error(f"fetch_fills: respuesta no JSON ({content_type}): {text}")
-                    return []
-
-                data = await resp.json()
-                if isinstance(data, list):
-                    fills = data
-                else:
-                    fills = data.get("userFills", {}).get("fills", [])
-
-                now = datetime.utcnow()
-                resultado = [
-                    fill
-                    for fill in fills
-                    if now - datetime.utcfromtimestamp(fill.get("time", 0) / 1000)
-                    <= timedelta(minutes=timeframe_minutes)
-                ]
-                return resultado
-        except Exception as e:
-            logging.error(f"fetch_fills: excepción al llamar a la API: {e}")
+            value = await loader()
+            fetched_at = time.time()
+            self._entries[key] = (fetched_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return value, fetched_at
+        finally:
+            self._inflight.pop(key, None)
+
+# positions_cache: clearinghouseState por dirección
+positions_cache = CoalescingCache(POSITIONS_CACHE_TTL, POSITIONS_CACHE_MAX_ENTRIES)
+# mids_cache: allMids (una sola clave) para valorar posiciones a precio de mercado
+mids_cache = CoalescingCache(POSITIONS_CACHE_TTL, 1)
+
+# positions_views: vistas "todas las wallets" de /positions ya paginadas
+# { chat_id: {"pages": [...], "fetched_at": s, "created_at": s} }
+positions_views = OrderedDict()
+
+async def cached_positions(address: str):
+    """
+    clearinghouseState de la dirección desde positions_cache: (data, fetched_at, stale).
+    Si la API falla se devuelven los últimos datos buenos con stale=True, y si
+    no los hay se propaga la excepción.
+    """
+    try:
+        data, fetched_at = await positions_cache.get(address, lambda: hl_client.clearinghouse_state(address))
+        return data, fetched_at, False
+    except Exception as e:
+        cached = positions_cache.peek(address)
+        if cached is None:
+            raise
+        logging.warning(f"cached_positions: {e}; se muestran los últimos datos de {address}")
+        return cached[0], cached[1], True
+
+async def gather_bounded(func, items, limit: int = HL_MAX_CONCURRENCY, on_result=None):
+    """
+    Ejecuta func(item) para cada item con un pool de `limit` workers,
+    así nunca hay más de `limit` peticiones en vuelo.
+    Devuelve los resultados en el orden de `items`; las excepciones se devuelven
+    en su posición en lugar de propagarse.
+    Si se indica, on_result(item, result) (corrutina) se espera según va
+    terminando cada item, para procesar resultados sin esperar al resto.
+    """
+    items = list(items)
+    results = [None] * len(items)
+    pending = iter(enumerate(items))
+
+    async def worker():
+        for idx, item in pending:
+            try:
+                results[idx] = await func(item)
+            except Exception as e:
+                results[idx] = e
+            if on_result is not None:
+                await on_result(item, results[idx])
+
+    await asyncio.gather(*(worker() for _ in range(min(limit, len(items)))))
+    return results
+
+def fill_id(fill: Fill):
+    """
+    Identificador único de un fill dentro de una dirección (tid, o hash si no hay tid).
+    """
+    return fill.tid if fill.tid is not None else fill.hash
+
+class FillDedup:
+    """
+    Conjunto acotado de fills ya alertados, con clave (address, tid).
+    Cada entrada guarda el time del fill; se expulsan las que quedan fuera de
+    la ventana de `ttl_minutes` y, si aun así se supera `max_entries`, las más
+    antiguas. La memoria queda acotada aunque el bot lleve semanas arrancado.
+    """
+
+    def __init__(self, ttl_minutes: int = DEDUP_TTL_MINUTES, max_entries: int = DEDUP_MAX_ENTRIES):
+        self.ttl_ms = ttl_minutes * 60 * 1000
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.evicted_expired = 0
+        self.evicted_overflow = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def check_and_add(self, address: str, fill: Fill) -> bool:
+        """
+        Devuelve True si el fill ya se había visto; si no, lo registra y devuelve False.
+        """
+        key = (address, fill_id(fill))
+        if key in self._entries:
+            self.hits += 1
+            return True
+        self._entries[key] = fill.time
+        self._evict()
+        return False
+
+    def _evict(self):
+        cutoff = int(time.time() * 1000) - self.ttl_ms
+        entries = self._entries
+        while entries:
+            oldest_key = next(iter(entries))
+            if entries[oldest_key] >= cutoff:
+                break
+            del entries[oldest_key]
+            self.evicted_expired += 1
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+            self.evicted_overflow += 1
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "evicted_expired": self.evicted_expired,
+            "evicted_overflow": self.evicted_overflow,
+        }
+
+# latest_fills para evitar alertas duplicadas
+latest_fills = FillDedup()
+
+class FillStore:
+    """
+    Fills recientes por dirección, ordenados por time, con el intervalo
+    [since, until] (ms) en el que se sabe que están todos.
+    El monitor lo mantiene caliente con cada consulta y /summary responde desde
+    aquí, yendo a la red solo para los huecos. Se guardan como mucho
+    FILL_STORE_RETENTION_MINUTES de historia y FILL_STORE_MAX_FILLS_PER_ADDRESS
+    fills por dirección; pasadas FILL_STORE_MAX_ADDRESSES direcciones o
+    FILL_STORE_MAX_FILLS fills se expulsan las usadas hace más tiempo, primero
+    las que ya no sigue nadie. Una dirección se suelta en cuanto deja de
+    seguirla el último chat (discard) y cada FILL_STORE_PRUNE_INTERVAL se
+    aplica la retención a todas, también a las que no reciben fills.
+    """
+
+    def __init__(
+        self,
+        retention_minutes: int = FILL_STORE_RETENTION_MINUTES,
+        max_addresses: int = FILL_STORE_MAX_ADDRESSES,
+        max_fills_per_address: int = FILL_STORE_MAX_FILLS_PER_ADDRESS,
+        max_fills: int = FILL_STORE_MAX_FILLS,
+    ):
+        self.retention_ms = retention_minutes * 60 * 1000
+        self.max_addresses = max_addresses
+        self.max_fills_per_address = max_fills_per_address
+        self.max_fills = max_fills
+        # { address: {"fills": [...], "ids": {...}, "since": ms, "until": ms, "version": n} }
+        self._entries = OrderedDict()
+        # Contador global: cada cambio de fills de una dirección le da una versión nueva
+        self._version = 0
+        self._fill_count = 0
+        self._last_prune = time.monotonic()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def fill_count(self) -> int:
+        return self._fill_count
+
+    def discard(self, address: str):
+        """
+        Suelta los fills de la dirección (p. ej. porque ya no la sigue nadie).
+        """
+        entry = self._entries.pop(address, None)
+        if entry is not None:
+            self._fill_count -= len(entry["fills"])
+
+    def prune_all(self):
+        """
+        Aplica la retención a todas las direcciones y suelta las que no sigue nadie.
+        """
+        self._last_prune = time.monotonic()
+        for address, entry in list(self._entries.items()):
+            if address not in subscribers:
+                self.discard(address)
+            elif self._prune(entry):
+                self._version += 1
+                entry["version"] = self._version
+
+    def add(self, address: str, fills: list, since: int = None, until: int = None):
+        """
+        Guarda `fills`, que son todos los de la dirección entre since y until (ms).
+        Sin since/until (fills empujados por WebSocket) no cambia el intervalo cubierto.
+        """
+        entry = self._entries.get(address)
+        if entry is None:
+            self._version += 1
+            entry = {"fills": [], "ids": set(), "since": since, "until": until, "version": self._version}
+            self._entries[address] = entry
+        elif since is None:
+            pass
+        elif entry["since"] is None or since > entry["until"] or until < entry["since"]:
+            # Rango no contiguo: solo se garantiza el nuevo
+            entry["since"], entry["until"] = since, until
+        else:
+            entry["since"] = min(entry["since"], since)
+            entry["until"] = max(entry["until"], until)
+
+        stored = entry["fills"]
+        added = 0
+        for fill in fills:
+            fid = fill_id(fill)
+            if fid in entry["ids"]:
+                continue
+            entry["ids"].add(fid)
+            added += 1
+            self._fill_count += 1
+            if not stored or fill.time >= stored[-1].time:
+                stored.append(fill)
+            else:
+                bisect.insort(stored, fill, key=lambda f: f.time)
+        if self._prune(entry) or added:
+            self._version += 1
+            entry["version"] = self._version
+        self._entries.move_to_end(address)
+        self._evict()
+        if time.monotonic() - self._last_prune >= FILL_STORE_PRUNE_INTERVAL:
+            self.prune_all()
+
+    def _prune(self, entry: dict) -> int:
+        """
+        Descarta los fills fuera de la retención o del máximo; devuelve cuántos.
+        """
+        stored = entry["fills"]
+        cutoff = int(time.time() * 1000) - self.retention_ms
+        drop = bisect.bisect_left(stored, cutoff, key=lambda f: f.time)
+        drop = max(drop, len(stored) - self.max_fills_per_address)
+        if drop > 0:
+            for fill in stored[:drop]:
+                entry["ids"].discard(fill_id(fill))
+            if entry["since"] is not None:
+                entry["since"] = max(entry["since"], stored[drop - 1].time + 1)
+            del stored[:drop]
+            self._fill_count -= drop
+        if entry["since"] is not None:
+            entry["since"] = max(entry["since"], cutoff)
+        return max(drop, 0)
+
+    def _evict(self):
+        # Siempre queda al menos una dirección
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_addresses or self._fill_count > self.max_fills
+        ):
+            victim = next((a for a in self._entries if a not in subscribers), None)
+            if victim is None:
+                victim = next(iter(self._entries))
+            self.discard(victim)
+
+    def missing(self, address: str, start: int, end: int, max_lag_ms: int = 0) -> list:
+        """
+        Rangos (start, end) de [start, end] que no están en el almacén.
+        Se da por cubierto el final si until tiene como mucho max_lag_ms de retraso.
+        """
+        entry = self._entries.get(address)
+        if entry is None or entry["since"] is None or entry["until"] < start or entry["since"] > end:
+            return [(start, end)]
+        gaps = []
+        if start < entry["since"]:
+            gaps.append((start, entry["since"]))
+        if entry["until"] < end - max_lag_ms:
+            gaps.append((entry["until"], end))
+        return gaps
+
+    def version(self, address: str):
+        """
+        Versión de los fills de la dirección (cambia con cada fill añadido o
+        descartado), o None si no está en el almacén.
+        """
+        entry = self._entries.get(address)
+        return None if entry is None else entry["version"]
+
+    def synced_until(self, address: str):
+        """
+        Hasta cuándo (ms) se tienen todos los fills de la dirección, o None.
+        """
+        entry = self._entries.get(address)
+        if entry is None or entry["since"] is None:
+            return None
+        return entry["until"]
+
+    def synced_since(self, address: str):
+        """
+        Desde cuándo (ms) se tienen todos los fills de la dirección, o None.
+        """
+        entry = self._entries.get(address)
+        if entry is None:
+            return None
+        return entry["since"]
+
+    def full(self, address: str) -> bool:
+        """
+        True si la dirección tiene ya FILL_STORE_MAX_FILLS_PER_ADDRESS fills:
+        descargar historia más antigua no serviría de nada.
+        """
+        entry = self._entries.get(address)
+        return entry is not None and len(entry["fills"]) >= self.max_fills_per_address
+
+    def density(self, address: str):
+        """
+        Fills por ms en el intervalo cubierto de la dirección, o None si no hay.
+        """
+        entry = self._entries.get(address)
+        if entry is None or entry["since"] is None or entry["until"] <= entry["since"]:
+            return None
+        return len(entry["fills"]) / (entry["until"] - entry["since"])
+
+    def window(self, address: str, start: int) -> list:
+        """
+        Fills guardados con time >= start.
+        """
+        entry = self._entries.get(address)
+        if entry is None:
             return []
+        self._entries.move_to_end(address)
+        stored = entry["fills"]
+        return stored[bisect.bisect_left(stored, start, key=lambda f: f.time):]
+
+# fill_store: ventana de fills recientes por dirección para /summary
+fill_store = FillStore()
+
+async def fetch_fills_since(address: str, start_time: int, end_time: int = None, max_pages: int = 10):
+    """
+    Descarga con userFillsByTime los fills desde start_time (ms), paginando de
+    HL_FILLS_PAGE_SIZE en HL_FILLS_PAGE_SIZE. Devuelve (fills ordenados por
+    time, truncated): truncated es True si se agotaron las max_pages con más
+    fills pendientes; entonces solo está completo hasta el ms anterior al
+    último fill. Las excepciones de la API se propagan.
+    """
+    with span("fetch_fills", address=address) as trace:
+        fills = []
+        seen = set()
+        truncated = False
+        for page_number in range(max_pages):
+            page = await hl_client.user_fills_by_time(address, start_time, end_time)
+            page.sort(key=lambda f: f.time)
+            for fill in page:
+                key = (fill.time, fill_id(fill))
+                if key not in seen:
+                    seen.add(key)
+                    fills.append(fill)
+            if len(page) < HL_FILLS_PAGE_SIZE:
+                break
+            if page_number == max_pages - 1:
+                truncated = True
+            # La página siguiente empieza en el último ms (inclusive); los repetidos se descartan
+            start_time = page[-1].time
+        trace.set_attribute("fills", len(fills))
+        trace.set_attribute("truncated", truncated)
+    return fills, truncated
+
+def covered_until(fills: list, truncated: bool, request_time: int) -> int:
+    """
+    Hasta cuándo (ms) están todos los fills de una descarga de fetch_fills_since.
+    """
+    return fills[-1].time - 1 if truncated else request_time
+
+async def fetch_fills_before(address: str, start_time: int, end_time: int,
+                             max_pages: int = SUMMARY_SYNC_MAX_PAGES, density: float = None):
+    """
+    Descarga hacia atrás desde end_time los fills de [start_time, end_time],
+    por ventanas de tiempo consecutivas de una página cada una. Así, si se
+    agotan las max_pages, lo descargado es el tramo más reciente y contiguo.
+    La primera ventana se ajusta a media página según `density` (fills por ms)
+    si se conoce; una ventana que no cabe en una página se descarta y se
+    estrecha según lo que trajo, y las que traen pocos fills se ensanchan.
+    Devuelve (fills ordenados por time, ms desde el que están completos).
+    """
+    fills = []
+    covered = end_time + 1
+    width = end_time - start_time + 1
+    if density:
+        width = min(width, max(1000, int(HL_FILLS_PAGE_SIZE / 2 / density)))
+    for _ in range(max_pages):
+        if covered <= start_time:
+            break
+        window_start = max(start_time, covered - width)
+        window, truncated = await fetch_fills_since(address, window_start, covered - 1, max_pages=1)
+        if truncated:
+            span_ms = max(window[-1].time - window_start, 1)
+            width = max(1, int(span_ms * HL_FILLS_PAGE_SIZE / 2 / len(window)))
+            continue
+        fills = window + fills
+        covered = window_start
+        if len(window) < HL_FILLS_PAGE_SIZE // 4:
+            width *= 2
+    return fills, min(covered, end_time)
+
+async def sync_fills(address: str, timeframe_minutes: int):
+    """
+    Completa en fill_store los fills de la dirección de los últimos
+    timeframe_minutes: solo se piden a userFillsByTime los huecos (p. ej.
+    historia anterior a la que ya tenía el monitor, o direcciones que el monitor
+    no consulta desde hace más de dos intervalos), como mucho
+    SUMMARY_SYNC_MAX_PAGES páginas. La historia se descarga hacia atrás, así lo
+    que no cabe queda para la siguiente vez (lo que falta se ve con
+    FillStore.missing).
+    Devuelve None si la API respondió, aunque no haya cabido todo; si la API
+    falla (o el circuit breaker está abierto) devuelve hasta cuándo (ms) está
+    completo lo que hay en el almacén (0 si no hay nada).
+    """
+    now_ms = int(time.time() * 1000)
+    start_time = now_ms - timeframe_minutes * 60 * 1000
+    max_lag_ms = int(2 * MONITOR_INTERVAL * 1000)
+    for gap_start, gap_end in fill_store.missing(address, start_time, now_ms, max_lag_ms):
+        try:
+            if gap_start == fill_store.synced_until(address):
+                # Hueco al final: hacia delante desde lo que ya hay
+                fills, truncated = await fetch_fills_since(address, gap_start, gap_end, SUMMARY_SYNC_MAX_PAGES)
+                until = covered_until(fills, truncated, gap_end)
+                if until >= gap_start:
+                    fill_store.add(address, fills, gap_start, until)
+                if truncated:
+                    # No es un fallo: el resto llega con el monitor o el siguiente refresh
+                    break
+            elif not fill_store.full(address):
+                fills, since = await fetch_fills_before(
+                    address, gap_start, gap_end, density=fill_store.density(address)
+                )
+                if since < gap_end:
+                    fill_store.add(address, fills, since, gap_end)
+        except HyperliquidError as e:
+            logging.error(f"sync_fills: {e} para dirección {address}")
+            return fill_store.synced_until(address) or 0
+        except Exception as e:
+            logging.error(f"sync_fills: excepción al llamar a la API: {e}")
+            return fill_store.synced_until(address) or 0
+    return None
+
+class SummaryEngine:
+    """
+    Agregados de /summary sobre fill_store. Por dirección y moneda guarda los
+    fills en columnas (time y sumas acumuladas de USD long, USD short y
+    cantidad), con numpy si está instalado o con array si no; se reconstruyen
+    solo cuando cambia la versión de la dirección en fill_store.
+    Cualquier ventana sale de una búsqueda binaria de su inicio y una resta de
+    sumas acumuladas, así todas se calculan a la vez. El resultado de un
+    conjunto de wallets se memoriza hasta que llegan fills nuevos o un fill sale
+    de alguna ventana.
+    """
+
+    def __init__(self, store: FillStore, windows=SUMMARY_WINDOWS, memo_max_entries: int = SUMMARY_MEMO_MAX_ENTRIES):
+        self.store = store
+        self.windows = tuple(windows)
+        self.memo_max_entries = memo_max_entries
+        # { address: (versión, { coin: (times, cum_long, cum_short, cum_size) }) }
+        self._columns = {}
+        # { direcciones: (versiones, válido hasta en ms, resultado) }
+        self._memo = OrderedDict()
+
+    def _build(self, fills: list) -> dict:
+        by_coin = {}
+        for fill in fills:
+            by_coin.setdefault(fill.coin, []).append(fill)
+        columns = {}
+        for coin, coin_fills in by_coin.items():
+            times = [f.time for f in coin_fills]
+            long_usd = [f.sz * f.px if f.side == "B" else 0.0 for f in coin_fills]
+            short_usd = [0.0 if f.side == "B" else f.sz * f.px for f in coin_fills]
+            sizes = [f.sz for f in coin_fills]
+            if np is not None:
+                columns[coin] = (np.array(times, dtype=np.int64),) + tuple(
+                    np.concatenate(([0.0], np.cumsum(values))) for values in (long_usd, short_usd, sizes)
+                )
+            else:
+                columns[coin] = (array("q", times),) + tuple(
+                    array("d", accumulate(values, initial=0.0)) for values in (long_usd, short_usd, sizes)
+                )
+        return columns
+
+    def columns(self, address: str) -> dict:
+        """
+        Columnas por moneda de la dirección, reconstruidas si tiene fills nuevos.
+        """
+        version = self.store.version(address)
+        if version is None:
+            self._columns.pop(address, None)
+            return {}
+        cached = self._columns.get(address)
+        if cached is None or cached[0] != version:
+            cached = (version, self._build(self.store.window(address, 0)))
+            self._columns[address] = cached
+            if len(self._columns) > 2 * max(len(self.store), 1):
+                for stale in [a for a in self._columns if self.store.version(a) is None]:
+                    del self._columns[stale]
+        return cached[1]
+
+    def summarize(self, addresses, now_ms: int = None) -> dict:
+        """
+        Agregados de las direcciones en cada ventana (minutos) que acaba ahora:
+        { ventana: { coin: {"long_usd", "short_usd", "total_amount", "wallets"} } }
+        """
+        now_ms = now_ms if now_ms is not None else int(time.time() * 1000)
+        key = tuple(sorted(set(addresses)))
+        versions = tuple(self.store.version(address) for address in key)
+        memo = self._memo.get(key)
+        if memo is not None and memo[0] == versions and now_ms < memo[1]:
+            self._memo.move_to_end(key)
+            return memo[2]
+
+        window_ms = [window * 60 * 1000 for window in self.windows]
+        cutoffs = [now_ms - ms for ms in window_ms]
+        result = {window: {} for window in self.windows}
+        # El resultado vale hasta que el fill más antiguo de alguna ventana sale de ella
+        valid_until = now_ms + max(window_ms, default=0)
+        for address in key:
+            for coin, (times, cum_long, cum_short, cum_size) in self.columns(address).items():
+                n = len(times)
+                if np is not None:
+                    starts = np.searchsorted(times, cutoffs).tolist()
+                else:
+                    starts = [bisect.bisect_left(times, cutoff) for cutoff in cutoffs]
+                for window, ms, start in zip(self.windows, window_ms, starts):
+                    if start == n:
+                        continue
+                    valid_until = min(valid_until, int(times[start]) + ms)
+                    totals = result[window].get(coin)
+                    if totals is None:
+                        totals = {"long_usd": 0.0, "short_usd": 0.0, "total_amount": 0.0, "wallets": 0}
+                        result[window][coin] = totals
+                    totals["long_usd"] += float(cum_long[n] - cum_long[start])
+                    totals["short_usd"] += float(cum_short[n] - cum_short[start])
+                    totals["total_amount"] += float(cum_size[n] - cum_size[start])
+                    totals["wallets"] += 1
+
+        self._memo[key] = (versions, valid_until, result)
+        self._memo.move_to_end(key)
+        while len(self._memo) > self.memo_max_entries:
+            self._memo.popitem(last=False)
+        return result
+
+# summary_engine: agregados de /summary memorizados sobre fill_store
+summary_engine = SummaryEngine(fill_store)
+
+def format_age(seconds: float) -> str:
+    """
+    Antigüedad legible: 12s, 5m, 3h.
+    """
+    if seconds < 60:
+        return f"{seconds:.0f}s"
+    if seconds < 3600:
+        return f"{seconds / 60:.0f}m"
+    return f"{seconds / 3600:.0f}h"
+
+# -----------------------
+# Persistencia
+# -----------------------
+
+class Storage:
+    """
+    Interfaz de persistencia de wallets, estados de los flujos y marcas de agua.
+    Las escrituras no esperan (se encolan); las lecturas son corrutinas.
+    Esta implementación no guarda nada (STORAGE_BACKEND=memory).
+    """
+
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    def save_wallet(self, chat_id, address: str, name: str):
+        pass
+
+    def delete_wallet(self, chat_id, address: str):
+        pass
+
+    def save_state(self, chat_id, state: dict):
+        pass
+
+    def delete_state(self, chat_id):
+        pass
+
+    def save_cursor(self, address: str, cursor: dict):
+        pass
+
+    def delete_cursor(self, address: str):
+        pass
+
+    async def load_chat(self, chat_id):
+        """
+        Devuelve (wallets, state) del chat.
+        """
+        return [], None
+
+    async def iter_cursors(self, chunk: int = STORAGE_LOAD_CHUNK):
+        """
+        Marcas de agua guardadas, en lotes de (address, cursor).
+        """
+        return
+        yield
+
+    async def iter_wallets(self, chunk: int = STORAGE_LOAD_CHUNK):
+        """
+        Todas las wallets, en lotes de (chat_id, address, name) ordenados por chat.
+        """
+        return
+        yield
+
+class SQLiteStorage(Storage):
+    """
+    Persistencia en SQLite (modo WAL). Cada mutación se encola y un flush
+    periódico la escribe junto con las demás en una sola transacción; las
+    marcas de agua pendientes de una misma dirección se escriben una sola vez.
+    Todo el acceso a la base de datos pasa por un único hilo.
+    close() escribe lo pendiente; se llama en el apagado (SIGTERM/SIGINT). Si el
+    proceso muere sin apagarse (SIGKILL, falta de memoria) se pierden las
+    mutaciones de como mucho los últimos STORAGE_FLUSH_INTERVAL segundos.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS wallets (
+            chat_id INTEGER NOT NULL,
+            address TEXT NOT NULL,
+            name TEXT NOT NULL,
+            PRIMARY KEY (chat_id, address)
+        );
+        CREATE INDEX IF NOT EXISTS wallets_address ON wallets (address);
+        CREATE TABLE IF NOT EXISTS user_states (
+            chat_id INTEGER PRIMARY KEY,
+            state TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS fill_cursors (
+            address TEXT PRIMARY KEY,
+            time INTEGER NOT NULL,
+            tids TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, path: str = DB_PATH, flush_interval: float = STORAGE_FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="storage")
+        self._conn = None
+        self._pending = []
+        # { address: cursor o None para borrar }
+        self._pending_cursors = {}
+        self._flush_task = None
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(self.SCHEMA)
+        return conn
+
+    async def open(self):
+        self._conn = await self._run(self._open)
+        self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        if self._conn is not None:
+            await self.flush()
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=False)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"SQLiteStorage: error al escribir: {e}")
+
+    async def flush(self):
+        if not self._pending and not self._pending_cursors:
+            return
+        batch, self._pending = self._pending, []
+        cursors, self._pending_cursors = self._pending_cursors, {}
+        for address, cursor in cursors.items():
+            if cursor is None:
+                batch.append(("DELETE FROM fill_cursors WHERE address = ?", (address,)))
+            else:
+                batch.append((
+                    "INSERT OR REPLACE INTO fill_cursors (address, time, tids) VALUES (?, ?, ?)",
+                    (address, cursor["time"], json.dumps(list(cursor["tids"]))),
+                ))
+        await self._run(self._write, batch)
+
+    def _write(self, batch: list):
+        with self._conn:
+            for sql, params in batch:
+                self._conn.execute(sql, params)
+
+    def save_wallet(self, chat_id, address: str, name: str):
+        self._pending.append((
+            "INSERT OR REPLACE INTO wallets (chat_id, address, name) VALUES (?, ?, ?)",
+            (chat_id, address, name),
+        ))
+
+    def delete_wallet(self, chat_id, address: str):
+        self._pending.append(("DELETE FROM wallets WHERE chat_id = ? AND address = ?", (chat_id, address)))
+
+    def save_state(self, chat_id, state: dict):
+        self._pending.append((
+            "INSERT OR REPLACE INTO user_states (chat_id, state) VALUES (?, ?)",
+            (chat_id, json.dumps(state)),
+        ))
+
+    def delete_state(self, chat_id):
+        self._pending.append(("DELETE FROM user_states WHERE chat_id = ?", (chat_id,)))
+
+    def save_cursor(self, address: str, cursor: dict):
+        self._pending_cursors[address] = cursor
+
+    def delete_cursor(self, address: str):
+        self._pending_cursors[address] = None
+
+    def _query(self, sql: str, params: tuple = ()):
+        return self._conn.execute(sql, params).fetchall()
+
+    async def load_chat(self, chat_id):
+        rows = await self._run(
+            self._query, "SELECT address, name FROM wallets WHERE chat_id = ? ORDER BY rowid", (chat_id,)
+        )
+        state_rows = await self._run(self._query, "SELECT state FROM user_states WHERE chat_id = ?", (chat_id,))
+        wallets = [{"address": address, "name": name} for address, name in rows]
+        state = json.loads(state_rows[0][0]) if state_rows else None
+        return wallets, state
+
+    async def iter_cursors(self, chunk: int = STORAGE_LOAD_CHUNK):
+        last = ""
+        while True:
+            rows = await self._run(
+                self._query,
+                "SELECT address, time, tids FROM fill_cursors WHERE address > ? ORDER BY address LIMIT ?",
+                (last, chunk),
+            )
+            if not rows:
+                return
+            yield [(address, {"time": t, "tids": set(json.loads(tids))}) for address, t, tids in rows]
+            last = rows[-1][0]
+
+    async def iter_wallets(self, chunk: int = STORAGE_LOAD_CHUNK):
+        last = (-(2 ** 63), "")
+        while True:
+            rows = await self._run(
+                self._query,
+                "SELECT chat_id, address, name FROM wallets WHERE (chat_id, address) > (?, ?) "
+                "ORDER BY chat_id, address LIMIT ?",
+                (*last, chunk),
+            )
+            if not rows:
+                return
+            yield rows
+            last = rows[-1][:2]
+
+storage = SQLiteStorage() if STORAGE_BACKEND == "sqlite" else Storage()
+
+async def load_chat(chat_id):
+    """
+    Carga bajo demanda las wallets y el estado del chat si aún no están en memoria.
+    Los handlers la llaman antes de leer user_data / user_states.
+    """
+    if chat_id in loaded_chats:
+        return
+    wallets, state = await storage.load_chat(chat_id)
+    if chat_id in loaded_chats:
+        return
+    current = user_data.setdefault(chat_id, [])
+    known = {w["address"] for w in current}
+    for w in wallets:
+        if w["address"] not in known:
+            current.append(w)
+            subscribers.setdefault(w["address"], {})[chat_id] = w["name"]
+    if state is not None and chat_id not in user_states:
+        user_states[chat_id] = state
+    loaded_chats.add(chat_id)
+
+async def load_subscriptions():
+    """
+    Carga en segundo plano las marcas de agua y luego todas las suscripciones,
+    por lotes, para que el arranque no dependa del número de wallets. El monitor
+    empieza a consultar cada dirección en cuanto aparece en subscribers; las
+    marcas de agua se cargan antes para no repetir ni perder alertas.
+    """
+    async for rows in storage.iter_cursors():
+        for address, cursor in rows:
+            fill_cursors.setdefault(address, cursor)
+    count = 0
+    async for rows in storage.iter_wallets():
+        for chat_id, address, name in rows:
+            # Los chats ya cargados por load_chat están completos en memoria
+            if chat_id in loaded_chats:
+                continue
+            wallets = user_data.setdefault(chat_id, [])
+            if any(w["address"] == address for w in wallets):
+                continue
+            wallets.append({"address": address, "name": name})
+            subscribers.setdefault(address, {})[chat_id] = name
+        count += len(rows)
+    monitor_status["subscriptions_loaded"] = True
+    logging.info(f"load_subscriptions: {count} wallets cargadas")
+
+def set_state(chat_id, state: dict):
+    user_states[chat_id] = state
+    storage.save_state(chat_id, state)
+
+def clear_state(chat_id):
+    if user_states.pop(chat_id, None) is not None:
+        storage.delete_state(chat_id)
+
+# -----------------------
+# Gestión de wallets
+# -----------------------
+
+def add_wallet(chat_id, address: str, name: str) -> bool:
+    """
+    Añade la wallet a user_data y al índice subscribers.
+    Devuelve False si el chat ya seguía esa dirección.
+    """
+    wallets = user_data.setdefault(chat_id, [])
+    if any(w["address"] == address for w in wallets):
+        return False
+    wallets.append({"address": address, "name": name})
+    subscribers.setdefault(address, {})[chat_id] = name
+    storage.save_wallet(chat_id, address, name)
+    return True
+
+def remove_wallet(chat_id, address: str) -> bool:
+    """
+    Quita la wallet de user_data y del índice subscribers.
+    Devuelve False si el chat no seguía esa dirección.
+    """
+    wallets = user_data.get(chat_id, [])
+    new_list = [w for w in wallets if w["address"] != address]
+    if len(new_list) == len(wallets):
+        return False
+    user_data[chat_id] = new_list
+    storage.delete_wallet(chat_id, address)
+    chats = subscribers.get(address, {})
+    chats.pop(chat_id, None)
+    if not chats:
+        subscribers.pop(address, None)
+        fill_store.discard(address)
+        if fill_cursors.pop(address, None) is not None:
+            storage.delete_cursor(address)
+    return True
+
+def rename_wallet(chat_id, address: str, new_name: str) -> bool:
+    """
+    Cambia el nombre de la wallet en user_data y en subscribers.
+    Devuelve False si el chat no seguía esa dirección.
+    """
+    for w in user_data.get(chat_id, []):
+        if w["address"] == address:
+            w["name"] = new_name
+            subscribers.setdefault(address, {})[chat_id] = new_name
+            storage.save_wallet(chat_id, address, new_name)
+            return True
+    return False
 
 # -----------------------
 # Handlers de Telegram
 # -----------------------
 
+@traced("handler.start_command")
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Comando /start: muestra menú con opciones.
@@ -105,6 +1823,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif update.callback_query:
         await update.callback_query.edit_message_text("Welcome! Please choose an option:", reply_markup=reply_markup)
 
+@traced("handler.menu_handler")
 async def menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Maneja los botones del menú (/start).
@@ -113,15 +1832,16 @@ async def menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     data = query.data
     chat_id = query.from_user.id
+    await load_chat(chat_id)
 
     if data == "menu_add":
-        user_states[chat_id] = {"stage": "awaiting_address_add"}
+        set_state(chat_id, {"stage": "awaiting_address_add"})
         await query.edit_message_text("✍️ Please send the address (0x...):")
     elif data == "menu_edit":
-        user_states[chat_id] = {"stage": "awaiting_address_edit"}
+        set_state(chat_id, {"stage": "awaiting_address_edit"})
         await query.edit_message_text("✍️ Please send the address you want to edit (0x...):")
     elif data == "menu_remove":
-        user_states[chat_id] = {"stage": "awaiting_address_remove"}
+        set_state(chat_id, {"stage": "awaiting_address_remove"})
         await query.edit_message_text("✍️ Please send the address you want to remove (0x...):")
     elif data == "menu_list":
         await list_command(update, context, from_button=True)
@@ -130,60 +1850,58 @@ async def menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif data == "menu_summary":
         await summary_command(update, context, from_button=True)
 
+@traced("handler.add_command")
 async def add_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Comando /add: inicia flujo para añadir dirección.
     """
     chat_id = update.effective_user.id
-    user_states[chat_id] = {"stage": "awaiting_address_add"}
+    await load_chat(chat_id)
+    set_state(chat_id, {"stage": "awaiting_address_add"})
     await update.message.reply_text("✍️ Please send the address (0x...):")
 
+@traced("handler.remove_command")
 async def remove_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Comando /remove <address> o flujo para eliminar dirección desde menú.
     """
     chat_id = update.effective_user.id
+    await load_chat(chat_id)
     if context.args:
         address = context.args[0]
-        addresses = user_data.get(chat_id, [])
-        new_list = [w for w in addresses if w["address"] != address]
-        if len(new_list) < len(addresses):
-            user_data[chat_id] = new_list
+        if remove_wallet(chat_id, address):
             await update.message.reply_text(f"🗑️ Address removed: {address}")
         else:
             await update.message.reply_text("⚠️ Address not found.")
     else:
-        user_states[chat_id] = {"stage": "awaiting_address_remove"}
+        set_state(chat_id, {"stage": "awaiting_address_remove"})
         await update.message.reply_text("✍️ Please send the address you want to remove (0x...):")
 
+@traced("handler.edit_command")
 async def edit_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Comando /edit <address> <new_name> o flujo para renombrar wallet.
     """
     chat_id = update.effective_user.id
+    await load_chat(chat_id)
     if len(context.args) >= 2:
         address = context.args[0]
         new_name = " ".join(context.args[1:])
-        addresses = user_data.get(chat_id, [])
-        found = False
-        for w in addresses:
-            if w["address"] == address:
-                w["name"] = new_name
-                found = True
-                break
-        if found:
+        if rename_wallet(chat_id, address, new_name):
             await update.message.reply_text(f"✏️ Wallet {address} renamed to '{new_name}'.")
         else:
             await update.message.reply_text("⚠️ Address not found.")
     else:
-        user_states[chat_id] = {"stage": "awaiting_address_edit"}
+        set_state(chat_id, {"stage": "awaiting_address_edit"})
         await update.message.reply_text("✍️ Please send the address you want to edit (0x...):")
 
+@traced("handler.handle_message")
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Maneja los mensajes de texto para los flujos de /add, /remove, /edit.
     """
     chat_id = update.effective_user.id
+    await load_chat(chat_id)
     text = update.message.text.strip()
 
     if chat_id not in user_states:
@@ -197,21 +1915,17 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not (text.startswith("0x") and len(text) == 42):
             await update.message.reply_text("⚠️ Invalid address format (must start with 0x and be 42 chars).")
             return
-        state["address"] = text
-        state["stage"] = "awaiting_name_add"
+        set_state(chat_id, {"stage": "awaiting_name_add", "address": text})
         await update.message.reply_text("🏷️ Now send a name for this wallet:")
         return
     if stage == "awaiting_name_add":
         name = text
         address = state["address"]
-        user_data.setdefault(chat_id, [])
-        exists = any(w["address"] == address for w in user_data[chat_id])
-        if exists:
-            await update.message.reply_text("⚠️ Address already added.")
-        else:
-            user_data[chat_id].append({"address": address, "name": name})
+        if add_wallet(chat_id, address, name):
             await update.message.reply_text("✅ Address added!")
-        user_states.pop(chat_id, None)
+        else:
+            await update.message.reply_text("⚠️ Address already added.")
+        clear_state(chat_id)
         return
 
     # Flujo /remove desde menú
@@ -220,14 +1934,11 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not (address.startswith("0x") and len(address) == 42):
             await update.message.reply_text("⚠️ Invalid address format.")
             return
-        addresses = user_data.get(chat_id, [])
-        new_list = [w for w in addresses if w["address"] != address]
-        if len(new_list) < len(addresses):
-            user_data[chat_id] = new_list
+        if remove_wallet(chat_id, address):
             await update.message.reply_text(f"🗑️ Address removed: {address}")
         else:
             await update.message.reply_text("⚠️ Address not found.")
-        user_states.pop(chat_id, None)
+        clear_state(chat_id)
         return
 
     # Flujo /edit desde menú
@@ -236,32 +1947,26 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not (address.startswith("0x") and len(address) == 42):
             await update.message.reply_text("⚠️ Invalid address format.")
             return
-        state["address"] = address
-        state["stage"] = "awaiting_name_edit"
+        set_state(chat_id, {"stage": "awaiting_name_edit", "address": address})
         await update.message.reply_text("🏷️ Send the new name for this wallet:")
         return
     if stage == "awaiting_name_edit":
         new_name = text
         address = state["address"]
-        addresses = user_data.get(chat_id, [])
-        found = False
-        for w in addresses:
-            if w["address"] == address:
-                w["name"] = new_name
-                found = True
-                break
-        if found:
+        if rename_wallet(chat_id, address, new_name):
             await update.message.reply_text(f"✏️ Wallet {address} renamed to '{new_name}'.")
         else:
             await update.message.reply_text("⚠️ Address not found.")
-        user_states.pop(chat_id, None)
+        clear_state(chat_id)
         return
 
+@traced("handler.list_command")
 async def list_command(update: Update, context: ContextTypes.DEFAULT_TYPE, from_button=False):
     """
     Comando /list: muestra direcciones guardadas.
     """
     chat_id = update.effective_user.id if not from_button else update.callback_query.from_user.id
+    await load_chat(chat_id)
     addresses = user_data.get(chat_id, [])
     if not addresses:
         msg = "📭 No addresses added."
@@ -274,11 +1979,13 @@ async def list_command(update: Update, context: ContextTypes.DEFAULT_TYPE, from_
     else:
         await update.message.reply_text(msg)
 
+@traced("handler.positions_command")
 async def positions_command(update: Update, context: ContextTypes.DEFAULT_TYPE, from_button=False):
     """
     Comando /positions: muestra botones con cada wallet para ver posiciones abiertas.
     """
     chat_id = update.effective_user.id if not from_button else update.callback_query.from_user.id
+    await load_chat(chat_id)
     addresses = user_data.get(chat_id, [])
     if not addresses:
         msg = "📭 No addresses added."
@@ -288,7 +1995,7 @@ async def positions_command(update: Update, context: ContextTypes.DEFAULT_TYPE,
             await update.message.reply_text(msg)
         return
 
-    keyboard = [
+    keyboard = [[InlineKeyboardButton("📊 All wallets", callback_data="posall_load")]] + [
         [InlineKeyboardButton(w["name"], callback_data=f"positions_{w['address']}")]
         for w in addresses
     ]
@@ -297,10 +2004,13 @@ async def positions_command(update: Update, context: ContextTypes.DEFAULT_TYPE,
     else:
         await update.message.reply_text("📌 Select a wallet:", reply_markup=InlineKeyboardMarkup(keyboard))
 
+@traced("handler.positions_callback")
 async def positions_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Callback de botones de /positions: usa clearinghouseState para mostrar posiciones.
-    Incluye botón de refresh.
+    La respuesta sale de positions_cache (válida POSITIONS_CACHE_TTL segundos)
+    e indica la antigüedad de los datos; si la API falla se muestran los últimos
+    datos buenos marcados como desactualizados. Incluye botón de refresh.
     """
     query = update.callback_query
     await query.answer()
@@ -308,30 +2018,30 @@ async def positions_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
     address = query.data.split("_", 1)[1]
 
     logging.info(f"positions_callback triggered for chat_id={chat_id}, address={address}")
+    boost_address(address)
 
-    url = "https://api.hyperliquid.xyz/info"
-    payload = {"type": "clearinghouseState", "user": address}
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.post(url, json=payload) as resp:
-                if resp.status != 200:
-                    await query.message.reply_text(f"Error {resp.status} retrieving positions.")
-                    return
-                content_type = resp.headers.get("Content-Type", "")
-                if "application/json" not in content_type:
-                    text = await resp.text()
-                    logging.error(f"positions_callback: respuesta no JSON ({content_type}): {text}")
-                    await query.message.reply_text("Error retrieving positions (invalid response).")
-                    return
-                data = await resp.json()
-        except Exception as e:
-            logging.error(f"positions_callback: excepción al llamar a la API: {e}")
-            await query.message.reply_text("Error retrieving positions (exception).")
-            return
+    try:
+        data, fetched_at, stale = await cached_positions(address)
+    except HyperliquidHTTPError as e:
+        await query.message.reply_text(f"Error {e.status} retrieving positions.")
+        return
+    except HyperliquidUnavailable:
+        await query.message.reply_text("Hyperliquid API unavailable, try again later.")
+        return
+    except HyperliquidResponseError as e:
+        logging.error(f"positions_callback: {e}")
+        await query.message.reply_text("Error retrieving positions (invalid response).")
+        return
+    except Exception as e:
+        logging.error(f"positions_callback: excepción al llamar a la API: {e}")
+        await query.message.reply_text("Error retrieving positions (exception).")
+        return
 
+    age = format_age(time.time() - fetched_at)
+    stale_note = f"⚠️ Hyperliquid API unavailable, showing data from {age} ago" if stale else None
     positions = data.get("assetPositions", [])
     if not positions:
-        await query.message.reply_text("No open positions.")
+        await query.message.reply_text("\n".join(filter(None, ["No open positions.", stale_note])))
         return
 
     lines = ["📈 <b>Open Positions</b>"]
@@ -345,6 +2055,7 @@ async def positions_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
         status_symbol = "🟢"
         lines.append(f"{status_symbol} Open {side_txt}")
         lines.append(f"{abs(size)} {coin} (${usd_value:,.2f})")
+    lines.append(stale_note or f"🕒 Updated {age} ago")
 
     keyboard = [
         [InlineKeyboardButton("🔄 Refresh", callback_data=f"positions_{address}")],
@@ -353,6 +2064,164 @@ async def positions_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
     reply_markup = InlineKeyboardMarkup(keyboard)
     await query.message.reply_text("\n".join(lines), parse_mode="HTML", reply_markup=reply_markup)
 
+def paginate(blocks: list, limit: int) -> list:
+    """
+    Reparte los bloques de texto en páginas de como mucho `limit` caracteres.
+    Un bloque solo se parte (por líneas) si no cabe en una página entera.
+    """
+    pages = []
+    current = ""
+    for block in blocks:
+        if len(block) <= limit:
+            pieces = [(block, "\n\n")]
+        else:
+            lines = block.split("\n")
+            pieces = [(lines[0][:limit], "\n\n")] + [(line[:limit], "\n") for line in lines[1:]]
+        for piece, sep in pieces:
+            if current and len(current) + len(sep) + len(piece) > limit:
+                pages.append(current)
+                current = ""
+            current = current + sep + piece if current else piece
+    if current:
+        pages.append(current)
+    return pages
+
+def build_positions_pages(wallet_results: list, mids: dict) -> list:
+    """
+    Páginas de la vista "todas las wallets": primero la exposición neta por
+    moneda sumando todas las wallets y luego las posiciones de cada una, valoradas
+    al precio de allMids (o al de entrada si falta la moneda).
+    wallet_results: [(wallet, (data, fetched_at, stale) o excepción), ...]
+    """
+    # { coin: {"net": tamaño, "long_usd": ..., "short_usd": ..., "px": precio, "wallets": n} }
+    exposure = {}
+    wallet_blocks = []
+    for wallet, result in wallet_results:
+        name = html.escape(wallet["name"])
+        if isinstance(result, Exception):
+            wallet_blocks.append(f"⚠️ <b>{name}</b>: positions unavailable")
+            continue
+        data, _, stale = result
+        lines = [f"👛 <b>{name}</b>" + (" (outdated)" if stale else "")]
+        for p in data.get("assetPositions", []):
+            pos = p.get("position", {})
+            coin = pos.get("coin")
+            size = float(pos.get("szi", 0))
+            if not size:
+                continue
+            price = float(mids.get(coin) or pos.get("entryPx") or 0)
+            usd_value = abs(size) * price
+            side_txt = "LONG" if size > 0 else "SHORT"
+            lines.append(f"{'🟢' if size > 0 else '🔴'} {side_txt} {abs(size)} {coin} (${usd_value:,.2f})")
+            totals = exposure.setdefault(coin, {"net": 0.0, "long_usd": 0.0, "short_usd": 0.0, "px": price, "wallets": 0})
+            totals["net"] += size
+            totals["long_usd" if size > 0 else "short_usd"] += usd_value
+            totals["wallets"] += 1
+        if len(lines) == 1:
+            lines.append("No open positions.")
+        wallet_blocks.append("\n".join(lines))
+
+    exposure_lines = [f"📊 <b>Net exposure</b> ({len(wallet_results)} wallets)"]
+    for coin, totals in sorted(exposure.items(), key=lambda x: -abs(x[1]["net"] * x[1]["px"])):
+        net = totals["net"]
+        side_txt = "LONG" if net > 0 else "SHORT" if net < 0 else "FLAT"
+        exposure_lines.append(
+            f"{'🟢' if net > 0 else '🔴' if net < 0 else '⚪'} <b>{coin}</b> {side_txt} "
+            f"{abs(net):,.4f} (${abs(net) * totals['px']:,.2f})"
+        )
+        exposure_lines.append(
+            f"Long ${totals['long_usd']:,.2f} vs Short ${totals['short_usd']:,.2f} (Wallets: {totals['wallets']})"
+        )
+    if not exposure:
+        exposure_lines.append("No open positions.")
+    # Margen para el pie con la página y la antigüedad
+    return paginate(["\n".join(exposure_lines)] + wallet_blocks, TELEGRAM_MAX_MESSAGE_LENGTH - 100)
+
+async def load_positions_view(chat_id) -> dict:
+    """
+    Consulta en paralelo clearinghouseState de todas las wallets del chat (como
+    mucho HL_MAX_CONCURRENCY a la vez, vía positions_cache) y una sola vez
+    allMids, y guarda la vista paginada en positions_views.
+    """
+    wallets = list(user_data.get(chat_id, []))
+    mids_task = asyncio.ensure_future(mids_cache.get("allMids", hl_client.all_mids))
+    results = await gather_bounded(lambda w: cached_positions(w["address"]), wallets)
+    try:
+        mids, _ = await mids_task
+    except Exception as e:
+        logging.error(f"load_positions_view: allMids falló ({e}); se usa el precio de entrada")
+        mids = {}
+    for wallet, result in zip(wallets, results):
+        if isinstance(result, Exception):
+            logging.error(f"load_positions_view: error en {wallet['address']}: {result}")
+    fetched = [r[1] for r in results if not isinstance(r, Exception)]
+    now = time.time()
+    view = {
+        "pages": build_positions_pages(list(zip(wallets, results)), mids),
+        "fetched_at": min(fetched, default=now),
+        "created_at": now,
+    }
+    positions_views[chat_id] = view
+    positions_views.move_to_end(chat_id)
+    while len(positions_views) > POSITIONS_VIEW_MAX_CHATS:
+        positions_views.popitem(last=False)
+    return view
+
+def render_positions_page(view: dict, page: int):
+    """
+    Texto y botones de una página de la vista "todas las wallets".
+    """
+    pages = view["pages"]
+    page = max(0, min(page, len(pages) - 1))
+    footer = f"🕒 Updated {format_age(time.time() - view['fetched_at'])} ago"
+    if len(pages) > 1:
+        footer += f" · Page {page + 1}/{len(pages)}"
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("◀️ Prev", callback_data=f"posall_{page - 1}"))
+    if page < len(pages) - 1:
+        nav.append(InlineKeyboardButton("Next ▶️", callback_data=f"posall_{page + 1}"))
+    keyboard = ([nav] if nav else []) + [
+        [InlineKeyboardButton("🔄 Refresh", callback_data="posall_reload")],
+        [InlineKeyboardButton("⬅️ Back", callback_data="menu_positions")],
+    ]
+    return pages[page] + "\n\n" + footer, InlineKeyboardMarkup(keyboard)
+
+@traced("handler.positions_all_callback")
+async def positions_all_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Callback de la vista "todas las wallets" de /positions:
+    posall_load (nuevo mensaje) y posall_reload consultan la API; posall_<n>
+    cambia de página editando el mensaje con los datos ya guardados (solo se
+    vuelve a consultar si la vista caducó).
+    """
+    query = update.callback_query
+    await query.answer()
+    chat_id = query.from_user.id
+    action = query.data.split("_", 1)[1]
+
+    logging.info(f"positions_all_callback triggered for chat_id={chat_id}, action={action}")
+    await load_chat(chat_id)
+    if not user_data.get(chat_id):
+        await query.message.reply_text("📭 No addresses added.")
+        return
+
+    view = positions_views.get(chat_id)
+    page = int(action) if action.isdigit() else 0
+    if action in ("load", "reload") or view is None or time.time() - view["created_at"] > POSITIONS_VIEW_TTL:
+        view = await load_positions_view(chat_id)
+    text, reply_markup = render_positions_page(view, page)
+    if action == "load":
+        await query.message.reply_text(text, parse_mode="HTML", reply_markup=reply_markup)
+        return
+    try:
+        await query.edit_message_text(text, parse_mode="HTML", reply_markup=reply_markup)
+    except BadRequest as e:
+        # Refresh sin cambios: Telegram rechaza editar con el mismo texto
+        if "not modified" not in str(e).lower():
+            raise
+
+@traced("handler.summary_command")
 async def summary_command(update: Update, context: ContextTypes.DEFAULT_TYPE, from_button=False):
     """
     Comando /summary: muestra botones para seleccionar rango de tiempo.
@@ -374,10 +2243,36 @@ async def summary_command(update: Update, context: ContextTypes.DEFAULT_TYPE, fr
             reply_markup=InlineKeyboardMarkup(keyboard)
         )
 
+def format_summary(summary_data: dict) -> list:
+    """
+    Líneas del resumen (una ventana de SummaryEngine.summarize), de mayor a
+    menor cantidad operada.
+    """
+    lines = []
+    idx = 1
+    for coin, data in sorted(summary_data.items(), key=lambda x: -x[1]["total_amount"]):
+        total_amount = data["total_amount"]
+        total_usd = data["long_usd"] + data["short_usd"]
+        long_pct = (data["long_usd"] / total_usd * 100) if total_usd > 0 else 0
+        short_pct = (data["short_usd"] / total_usd * 100) if total_usd > 0 else 0
+        wallet_count = data["wallets"]
+
+        lines.append(f"{idx}.- {total_amount:,.2f} {coin} (${total_usd:,.2f})")
+        lines.append(f"Long {long_pct:.0f}% vs Short {short_pct:.0f}% (Wallets: {wallet_count})")
+        idx += 1
+    return lines
+
+@traced("handler.summary_callback")
 async def summary_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Callback de botones de /summary: muestra resumen de cada wallet en ese periodo.
-    Incluye botón de refresh.
+    Las wallets se sincronizan en paralelo en fill_store solo para el periodo
+    elegido y el resumen sale de summary_engine; con muchas wallets se muestra
+    un mensaje de progreso que acaba siendo el resumen. Si la API falla se
+    resume lo que haya en fill_store con un aviso de antigüedad, y si una
+    wallet tiene más historia de la que cabe en SUMMARY_SYNC_MAX_PAGES se avisa
+    de que el resumen es parcial (el refresh sigue descargándola). Incluye
+    botón de refresh.
     """
     query = update.callback_query
     await query.answer()
@@ -386,94 +2281,1034 @@ async def summary_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     logging.info(f"summary_callback triggered for chat_id={chat_id}, period={period}")
 
+    await load_chat(chat_id)
     addresses = user_data.get(chat_id, [])
     if not addresses:
         await query.message.reply_text("You haven’t added any addresses yet.")
         return
 
-    summary_data = {}
-    wallets_per_coin = {}
+    stale_since = []
+    stale_addresses = set()
+    total = len(addresses)
+    done = 0
+    progress = None
+    last_edit = time.monotonic()
+    if total >= SUMMARY_PROGRESS_MIN_WALLETS:
+        progress = await query.message.reply_text(f"⏳ Loading summary… 0/{total} wallets")
+
+    async def on_result(addr, result):
+        nonlocal done, last_edit
+        done += 1
+        if isinstance(result, Exception):
+            logging.error(f"summary_callback: error en {addr['address']}: {result}")
+        elif result is not None:
+            stale_since.append(result)
+            stale_addresses.add(addr["address"])
+        if progress is not None and done < total and time.monotonic() - last_edit >= SUMMARY_PROGRESS_EDIT_INTERVAL:
+            last_edit = time.monotonic()
+            try:
+                await progress.edit_text(f"⏳ Loading summary… {done}/{total} wallets")
+            except Exception as e:
+                logging.error(f"summary_callback: error editando progreso: {e}")
+
+    await gather_bounded(lambda addr: sync_fills(addr["address"], period), addresses, on_result=on_result)
+    # Wallets a las que les falta algún tramo del periodo aunque la API respondió:
+    # más fills de los que caben en SUMMARY_SYNC_MAX_PAGES páginas
+    now_ms = int(time.time() * 1000)
+    start_time = now_ms - period * 60 * 1000
+    max_lag_ms = int(2 * MONITOR_INTERVAL * 1000)
+    partial = [
+        a["address"] for a in addresses
+        if a["address"] not in stale_addresses
+        and fill_store.missing(a["address"], start_time, now_ms, max_lag_ms)
+    ]
+    if period in summary_engine.windows:
+        summary_data = summary_engine.summarize(a["address"] for a in addresses)[period]
+    else:
+        summary_data = SummaryEngine(fill_store, [period]).summarize(a["address"] for a in addresses)[period]
+
+    notes = []
+    if stale_since:
+        oldest = min(stale_since)
+        age = format_age(time.time() - oldest / 1000) + " old" if oldest else "missing"
+        notes.append(f"⚠️ Hyperliquid API unavailable: {len(stale_since)} wallet(s) with data {age}")
+    if partial:
+        # Solo falta historia antigua: se dice cuánta hay; si falta lo reciente, no
+        behind = any(fill_store.missing(a, now_ms - max_lag_ms, now_ms, max_lag_ms) for a in partial)
+        loaded = ""
+        if not behind:
+            oldest = min(fill_store.synced_since(a) for a in partial)
+            loaded = f", only the last {format_age(time.time() - oldest / 1000)} loaded"
+        more = "" if not behind and all(fill_store.full(a) for a in partial) else " (refresh to load more)"
+        notes.append(f"⚠️ Partial: {len(partial)} wallet(s) with too many fills{loaded}{more}")
+
+    if not summary_data and not partial:
+        text = "\n".join(["⚠️ No operations in timeframe."] + notes)
+        reply_markup = None
+    else:
+        text = "\n".join((format_summary(summary_data) if summary_data else ["⚠️ No operations loaded yet."]) + notes)
+        keyboard = [
+            [InlineKeyboardButton("🔄 Refresh", callback_data=f"summary_{period}")],
+            [InlineKeyboardButton("⬅️ Back", callback_data="menu_summary")],
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+    if progress is not None:
+        await progress.edit_text(text, parse_mode="HTML", reply_markup=reply_markup)
+    else:
+        await query.message.reply_text(text, parse_mode="HTML", reply_markup=reply_markup)
+
+# -----------------------
+# Monitoreo y alertas
+# -----------------------
+
+def format_fill_alert(name: str, fill: Fill) -> str:
+    """
+    Texto HTML de la alerta de un fill.
+    """
+    coin = fill.coin
+    size = fill.sz
+    # dir: "Open Long", "Close Short", "Buy", "Long > Short"...; side ("B"
+    # compra, "A" venta) solo si la API no lo trae
+    direction = fill.dir or ("Buy" if fill.side == "B" else "Sell")
+    icon = "🟢" if direction.startswith(("Open", "Buy")) else "🔴"
+    price = fill.px
+    total = size * price
+    dt = datetime.utcfromtimestamp(fill.time / 1000) + timedelta(hours=2)
+    dt_str = dt.strftime("%d/%m/%Y %H:%M")
+    return (
+        f"📡 <b>{html.escape(name)}</b>\n"
+        f"{icon} <b>{html.escape(direction)}</b> {size} {coin} (${total:,.2f})\n"
+        f"🕒 {dt_str} UTC+2"
+    )
+
+def new_fills_after(cursor: dict, fills: list) -> list:
+    """
+    Filtra los fills (ordenados por time) posteriores a la marca de agua.
+    """
+    return [
+        fill for fill in fills
+        if fill.time > cursor["time"]
+        or (fill.time == cursor["time"] and fill_id(fill) not in cursor["tids"])
+    ]
+
+def advance_cursor(cursor: dict, fills: list) -> dict:
+    """
+    Nueva marca de agua tras procesar `fills` (ordenados por time).
+    """
+    if not fills:
+        return cursor
+    last_time = fills[-1].time
+    tids = {fill_id(f) for f in fills if f.time == last_time}
+    if last_time == cursor["time"]:
+        tids |= cursor["tids"]
+    return {"time": last_time, "tids": tids}
+
+class AlertSender:
+    """
+    Cola de envío de alertas a Telegram, desacoplada del sondeo.
+    Las alertas de un mismo chat que llegan dentro de ALERT_BATCH_WINDOW se unen
+    en un solo mensaje. Unos pocos workers envían respetando un token bucket
+    global y otro por chat, y reintentan los errores de red y los RetryAfter
+    (esperando lo que indica Telegram, con todos los workers en pausa).
+    El callback on_done de cada alerta se llama cuando se ha enviado o se ha
+    dado por perdida.
+    """
+
+    def __init__(self, workers: int = ALERT_SEND_WORKERS, batch_window: float = ALERT_BATCH_WINDOW):
+        self.workers = workers
+        self.batch_window = batch_window
+        self.bot = None
+        self._queue = asyncio.Queue()
+        # { chat_id: [(texto, time del fill en ms, on_done), ...] } alertas que aún no se han enviado
+        self._pending = {}
+        self._chat_buckets = {}
+        self._global_bucket = TokenBucket(TELEGRAM_GLOBAL_RATE, TELEGRAM_GLOBAL_RATE)
+        self._paused_until = 0.0
+        self._tasks = []
+        self.sent = 0
+        self.failed = 0
+
+    def start(self, bot):
+        self.bot = bot
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def close(self, timeout: float = ALERT_DRAIN_TIMEOUT):
+        """
+        Espera como mucho `timeout` s a que se envíe lo encolado y para los
+        workers. Las alertas que queden sin enviar no llaman a on_done.
+        """
+        if self._tasks:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout)
+            except asyncio.TimeoutError:
+                logging.warning(f"AlertSender: {self.qsize()} alertas sin enviar al cerrar")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
 
-    for addr in addresses:
-        fills = await fetch_fills(addr["address"], period)
-        for f in fills:
-            coin = f.get("coin", "?")
-            size = float(f.get("sz", 0))
-            price = float(f.get("px", 0))
-            direction = f.get("dir", "").upper()
-            usd = size * price
+    def qsize(self) -> int:
+        return sum(len(alerts) for alerts in self._pending.values())
 
-            if coin not in summary_data:
-                summary_data[coin] = {"long_usd": 0.0, "short_usd": 0.0, "total_amount": 0.0}
-                wallets_per_coin[coin] = set()
+    def enqueue(self, chat_id, text: str, fill_time: int = None, on_done=None):
+        """
+        Encola una alerta; fill_time (ms) sirve para medir el retraso de la alerta.
+        """
+        if chat_id in self._pending:
+            self._pending[chat_id].append((text, fill_time, on_done))
+            return
+        self._pending[chat_id] = [(text, fill_time, on_done)]
+        due = asyncio.get_running_loop().time() + self.batch_window
+        self._queue.put_nowait((due, chat_id))
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > 10000:
+                # Se descartan los buckets que ya se han rellenado del todo (y
+                # nadie está esperando): equivalen a uno nuevo
+                for key, b in list(self._chat_buckets.items()):
+                    if not b._lock.locked():
+                        b._refill()
+                        if b.tokens >= b.capacity:
+                            del self._chat_buckets[key]
+            bucket = TokenBucket(TELEGRAM_CHAT_RATE, 1)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
 
-            if direction == "L":
-                summary_data[coin]["long_usd"] += usd
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            due, chat_id = await self._queue.get()
+            try:
+                # La cola sale en orden de llegada, así que `due` es creciente
+                await asyncio.sleep(max(0, due - loop.time()))
+                alerts = self._pending.pop(chat_id, [])
+                for text, fill_times, callbacks in self._batch(alerts):
+                    await self._chat_bucket(chat_id).acquire()
+                    if await self._send(chat_id, text):
+                        now = time.time()
+                        for fill_time in fill_times:
+                            ALERT_DELAY_SECONDS.observe(max(0.0, now - fill_time / 1000))
+                    for on_done in callbacks:
+                        on_done()
+            finally:
+                self._queue.task_done()
+
+    def _batch(self, alerts: list) -> list:
+        """
+        Une las alertas en mensajes de como mucho TELEGRAM_MAX_MESSAGE_LENGTH caracteres.
+        Devuelve [(texto, [time de cada fill incluido], [on_done]), ...].
+        """
+        messages = []
+        for text, fill_time, on_done in alerts:
+            if messages and len(messages[-1][0]) + 2 + len(text) <= TELEGRAM_MAX_MESSAGE_LENGTH:
+                messages[-1][0] += "\n\n" + text
             else:
-                summary_data[coin]["short_usd"] += usd
+                messages.append([text, [], []])
+            if fill_time is not None:
+                messages[-1][1].append(fill_time)
+            if on_done is not None:
+                messages[-1][2].append(on_done)
+        return messages
 
-            summary_data[coin]["total_amount"] += size
-            wallets_per_coin[coin].add(addr["address"])
+    async def _send(self, chat_id, text: str) -> bool:
+        loop = asyncio.get_running_loop()
+        for attempt in range(ALERT_MAX_RETRIES):
+            await asyncio.sleep(max(0, self._paused_until - loop.time()))
+            await self._global_bucket.acquire()
+            try:
+                with span("telegram.send_message", chat_id=chat_id, attempt=attempt):
+                    await self.bot.send_message(chat_id=chat_id, text=text, parse_mode="HTML")
+                self.sent += 1
+                return True
+            except RetryAfter as e:
+                logging.warning(f"AlertSender: RetryAfter {e.retry_after}s")
+                self._paused_until = max(self._paused_until, loop.time() + e.retry_after)
+            except (Forbidden, BadRequest) as e:
+                logging.error(f"Error sending alert to {chat_id}: {e}")
+                break
+            except Exception as e:
+                logging.error(f"Error sending alert to {chat_id} (intento {attempt + 1}): {e}")
+                await asyncio.sleep(2 ** attempt + random.random())
+        self.failed += 1
+        return False
 
-    if not summary_data:
-        await query.message.reply_text("⚠️ No operations in timeframe.")
-        return
+# alert_sender: cola de alertas; se arranca en on_startup con el bot
+alert_sender = AlertSender()
 
-    lines = []
-    idx = 1
-    for coin, data in sorted(summary_data.items(), key=lambda x: -x[1]["total_amount"]):
-        total_amount = data["total_amount"]
-        total_usd = data["long_usd"] + data["short_usd"]
-        long_pct = (data["long_usd"] / total_usd * 100) if total_usd > 0 else 0
-        short_pct = (data["short_usd"] / total_usd * 100) if total_usd > 0 else 0
-        wallet_count = len(wallets_per_coin[coin])
+def get_cursor(address: str) -> dict:
+    """
+    Marca de agua de la dirección; una dirección nueva empieza en los últimos
+    ALERT_LOOKBACK_MINUTES.
+    """
+    cursor = fill_cursors.get(address)
+    if cursor is None:
+        now_ms = int(time.time() * 1000)
+        cursor = {"time": now_ms - ALERT_LOOKBACK_MINUTES * 60 * 1000, "tids": set()}
+    return cursor
 
-        lines.append(f"{idx}.- {total_amount:,.2f} {coin} (${total_usd:,.2f})")
-        lines.append(f"Long {long_pct:.0f}% vs Short {short_pct:.0f}% (Wallets: {wallet_count})")
-        idx += 1
+# Marcas de agua a la espera de que se envíen sus alertas, en orden de avance:
+# { address: [[cursor, alertas pendientes], ...] }
+pending_cursors = {}
 
-    keyboard = [
-        [InlineKeyboardButton("🔄 Refresh", callback_data=f"summary_{period}")],
-        [InlineKeyboardButton("⬅️ Back", callback_data="menu_summary")],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.message.reply_text("\n".join(lines), parse_mode="HTML", reply_markup=reply_markup)
+def commit_cursor_when_sent(address: str, cursor: dict, alerts: int):
+    """
+    Persiste `cursor` cuando se hayan enviado (o dado por perdidas) sus
+    `alerts` alertas y las de todas las marcas anteriores de la dirección; así
+    un reinicio con alertas aún en cola las vuelve a pedir en vez de perderlas.
+    Devuelve el callback on_done para alert_sender.enqueue.
+    """
+    entry = [cursor, alerts]
+    pending_cursors.setdefault(address, []).append(entry)
 
-# -----------------------
-# Monitoreo y alertas
-# -----------------------
+    def flush():
+        waiting = pending_cursors.get(address, [])
+        done = None
+        while waiting and waiting[0][1] <= 0:
+            done = waiting.pop(0)[0]
+        if not waiting:
+            pending_cursors.pop(address, None)
+        # Si la dirección se dejó de seguir, remove_wallet ya borró su marca
+        if done is not None and address in subscribers:
+            storage.save_cursor(address, done)
+
+    def on_done():
+        entry[1] -= 1
+        flush()
+
+    flush()
+    return on_done
+
+async def process_fills(app, address: str, fills: list):
+    """
+    Encola alerta por cada fill posterior a la marca de agua para todos los chats
+    que siguen la dirección. La marca de agua avanza en memoria enseguida, pero
+    solo se persiste cuando alert_sender ha enviado sus alertas (ver
+    commit_cursor_when_sent). Lo usan tanto el sondeo REST como el streaming por
+    WebSocket. Devuelve el número de fills nuevos.
+    """
+    fills = new_fills_after(get_cursor(address), sorted(fills, key=lambda f: f.time))
+    with span("dedup", fills=len(fills)):
+        fresh = [fill for fill in fills if not latest_fills.check_and_add(address, fill)]
+    # Si la dirección se dejó de seguir durante la consulta no se guarda la marca de agua.
+    # Se parte de la marca actual: otra tarea (REST o WebSocket) puede haberla avanzado.
+    on_done = None
+    if address in subscribers:
+        cursor = get_cursor(address)
+        new_cursor = advance_cursor(cursor, new_fills_after(cursor, fills))
+        if new_cursor is not fill_cursors.get(address):
+            fill_cursors[address] = new_cursor
+            chats = subscribers.get(address, {})
+            on_done = commit_cursor_when_sent(address, new_cursor, len(fresh) * len(chats))
+    with span("format_alerts", fills=len(fresh)):
+        for fill in fresh:
+            for chat_id, name in subscribers.get(address, {}).items():
+                alert_sender.enqueue(chat_id, format_fill_alert(name, fill), fill.time, on_done)
+    return len(fills)
+
+async def check_address(app, address: str):
+    """
+    Pide solo los fills posteriores a la marca de agua de la dirección y los
+    procesa con process_fills. De paso mantiene caliente fill_store para /summary.
+    Devuelve el número de fills nuevos.
+    """
+    with span("check_address", address=address):
+        start_time = get_cursor(address)["time"]
+        request_time = int(time.time() * 1000)
+        fills, truncated = await fetch_fills_since(address, start_time)
+        fill_store.add(address, fills, start_time, covered_until(fills, truncated, request_time))
+        return await process_fills(app, address, fills)
+
+class PollScheduler:
+    """
+    Planificador de consultas con un intervalo propio por dirección, en una cola
+    de prioridad por próxima consulta. Una dirección con fills nuevos baja su
+    intervalo a la mitad (hasta `floor`); sin fills lo dobla (hasta `ceiling`).
+    boost() fija el mínimo durante POLL_BOOST_SECONDS.
+    """
+
+    def __init__(self, base: float = MONITOR_INTERVAL, floor: float = POLL_MIN_INTERVAL, ceiling: float = POLL_MAX_INTERVAL):
+        self.base = base
+        self.floor = floor
+        self.ceiling = ceiling
+        # (due, address); las entradas obsoletas se descartan al sacarlas
+        self._heap = []
+        # { address: {"interval": s, "due": t, "boost_until": t} }
+        self._state = {}
+
+    def __len__(self):
+        return len(self._state)
+
+    def _schedule(self, address: str, due: float):
+        self._state[address]["due"] = due
+        heapq.heappush(self._heap, (due, address))
+
+    def sync(self, addresses):
+        """
+        Añade las direcciones nuevas (consulta inmediata) y olvida las que ya no se siguen.
+        """
+        addresses = set(addresses)
+        now = time.monotonic()
+        for address in addresses:
+            if address not in self._state:
+                self._state[address] = {"interval": self.base, "due": now, "boost_until": 0.0}
+                self._schedule(address, now)
+        for address in [a for a in self._state if a not in addresses]:
+            del self._state[address]
+
+    def pop_due(self, now: float, limit: int = None):
+        """
+        Saca las direcciones a consultar ya (como mucho `limit`).
+        Devuelve (direcciones, retraso máximo en s).
+        """
+        due = []
+        lag = 0.0
+        while self._heap and self._heap[0][0] <= now and (limit is None or len(due) < limit):
+            when, address = heapq.heappop(self._heap)
+            state = self._state.get(address)
+            if state is None or state["due"] != when:
+                continue
+            state["due"] = None
+            lag = max(lag, now - when)
+            due.append(address)
+        return due, lag
+
+    def next_due(self):
+        while self._heap:
+            when, address = self._heap[0]
+            state = self._state.get(address)
+            if state is not None and state["due"] == when:
+                return when
+            heapq.heappop(self._heap)
+        return None
+
+    def record(self, address: str, new_fills: int = None):
+        """
+        Reprograma la dirección tras consultarla; new_fills=None si la consulta falló.
+        """
+        state = self._state.get(address)
+        if state is None:
+            return
+        now = time.monotonic()
+        if now < state["boost_until"]:
+            state["interval"] = self.floor
+        elif new_fills:
+            state["interval"] = max(self.floor, state["interval"] / 2)
+        elif new_fills is not None:
+            state["interval"] = min(self.ceiling, state["interval"] * 2)
+        self._schedule(address, now + state["interval"])
+
+    def boost(self, address: str):
+        state = self._state.get(address)
+        if state is None:
+            return
+        now = time.monotonic()
+        state["boost_until"] = now + POLL_BOOST_SECONDS
+        state["interval"] = self.floor
+        # Si está pendiente de consulta se adelanta; si está en vuelo lo hará record()
+        if state["due"] is not None and state["due"] > now + self.floor:
+            self._schedule(address, now + self.floor)
+
+async def mark_progress(*_):
+    """
+    Marca de vida del monitor tras cada dirección consultada (on_result de gather_bounded).
+    """
+    monitor_status["last_progress_at"] = time.time()
+
+def mark_sweep():
+    """
+    Marca de vida del monitor tras cada vuelta completa.
+    """
+    now = time.time()
+    monitor_status["last_sweep_at"] = now
+    monitor_status["last_progress_at"] = now
+
+async def scheduled_sweeps(scheduler: PollScheduler, get_addresses, poll, label: str):
+    """
+    Bucle de sondeo común al monitor y a los pollers: en cada vuelta sincroniza
+    el planificador con get_addresses(), consulta en paralelo con poll(address)
+    las direcciones que tocan y las reprograma según sus fills nuevos. Mientras
+    el circuit breaker de hl_client está abierto no se consulta nada.
+    Produce (direcciones consultadas, duración) tras cada vuelta, también las vacías.
+    """
+    while True:
+        scheduler.sync(get_addresses())
+        sweep_start = time.monotonic()
+        breaker = hl_client.breaker
+        if breaker.state == "open" and breaker.retry_in() > 0:
+            # API caída: se pausa todo el sondeo hasta la petición de prueba
+            mark_sweep()
+            yield [], 0.0
+            await asyncio.sleep(min(1.0, breaker.retry_in()))
+            continue
+        # Con el circuito medio abierto solo sale una dirección, que hace de prueba
+        addresses, lag = scheduler.pop_due(sweep_start, limit=None if breaker.closed else 1)
+        with span("sweep", label=label, addresses=len(addresses)):
+            results = await gather_bounded(poll, addresses, on_result=mark_progress)
+        for address, result in zip(addresses, results):
+            if isinstance(result, Exception):
+                if not isinstance(result, HyperliquidUnavailable):
+                    logging.error(f"{label}: error en {address}: {result}")
+                scheduler.record(address, None)
+            else:
+                scheduler.record(address, result)
+        elapsed = time.monotonic() - sweep_start
+        if lag > MONITOR_INTERVAL:
+            logging.warning(
+                f"{label}: {len(addresses)} direcciones consultadas con {lag:.1f}s de retraso "
+                f"(el barrido tardó {elapsed:.1f}s)"
+            )
+        mark_sweep()
+        yield addresses, elapsed
+        next_due = scheduler.next_due()
+        now = time.monotonic()
+        wait = 1.0 if next_due is None else min(1.0, next_due - now)
+        await asyncio.sleep(max(0.05, wait))
+
+# poll_scheduler: intervalos por dirección del monitor en este proceso
+poll_scheduler = PollScheduler()
+
+# poller_pool: pollers del modo sharding mientras está activo
+poller_pool = None
+
+def boost_address(address: str):
+    """
+    Consulta la dirección al intervalo mínimo durante un rato (p. ej. al verla en /positions).
+    """
+    poll_scheduler.boost(address)
+    if poller_pool is not None:
+        poller_pool.boost(address)
+
+class StreamConnection:
+    """
+    Una conexión WebSocket con suscripciones userFills para varias direcciones.
+    Se reconecta sola con backoff exponencial y al reconectar vuelve a suscribir
+    todas las direcciones. Solo las suscripciones que el servidor confirma
+    (subscriptionResponse) cuentan como activas; las demás, también mientras la
+    conexión está caída, las consulta stream_wallets por REST.
+    unconfirmed() dice cuáles siguen sin confirmar para que FillStream las libere.
+    """
+
+    def __init__(self, app, url: str):
+        self.app = app
+        self.url = url
+        # { address en minúsculas: address tal y como la siguen los chats }
+        self.addresses = {}
+        # Direcciones (en minúsculas) con la suscripción confirmada en esta conexión
+        self.acked = set()
+        # { address en minúsculas: time.monotonic() del último subscribe enviado }
+        self.sent = {}
+        # time.monotonic() del último mensaje de error del servidor
+        self.error_at = float("-inf")
+        self.ws = None
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _send(self, method: str, address: str):
+        if self.ws is None or self.ws.closed:
+            return
+        await self.ws.send_str(json.dumps({
+            "method": method,
+            "subscription": {"type": "userFills", "user": address},
+        }))
+        if method == "subscribe":
+            self.sent[address.lower()] = time.monotonic()
+
+    async def add(self, address: str):
+        self.addresses[address.lower()] = address
+        await self._send("subscribe", address)
+
+    async def remove(self, address: str):
+        self.addresses.pop(address.lower(), None)
+        self.acked.discard(address.lower())
+        self.sent.pop(address.lower(), None)
+        await self._send("unsubscribe", address)
+
+    def unconfirmed(self, timeout: float) -> list:
+        """
+        Direcciones cuyo subscribe se envió hace más de `timeout` segundos, o
+        antes de un error del servidor, y que el servidor no ha confirmado.
+        Con la conexión caída no hay ninguna: al reconectar se vuelven a enviar.
+        """
+        now = time.monotonic()
+        return [
+            self.addresses[user] for user, sent_at in self.sent.items()
+            if user not in self.acked and (now - sent_at >= timeout or sent_at <= self.error_at)
+        ]
+
+    async def _run(self):
+        delay = 1
+        while True:
+            try:
+                self.ws = await hl_client.ws_connect(self.url, heartbeat=None)
+                delay = 1
+                await self._serve()
+            except asyncio.CancelledError:
+                if self.ws is not None:
+                    await self.ws.close()
+                raise
+            except Exception as e:
+                logging.error(f"StreamConnection: error en WebSocket: {e}")
+            self.acked.clear()
+            self.sent.clear()
+            logging.warning(f"StreamConnection: desconectado, reintento en {delay}s")
+            await asyncio.sleep(delay + random.random())
+            delay = min(delay * 2, WS_RECONNECT_MAX_DELAY)
+
+    async def _ping(self):
+        while not self.ws.closed:
+            await asyncio.sleep(WS_PING_INTERVAL)
+            await self.ws.send_str(json.dumps({"method": "ping"}))
+
+    async def _serve(self):
+        self.acked.clear()
+        self.sent.clear()
+        for address in list(self.addresses.values()):
+            await self._send("subscribe", address)
+        ping = asyncio.create_task(self._ping())
+        try:
+            async for msg in self.ws:
+                if msg.type != aiohttp.WSMsgType.TEXT:
+                    break
+                await self._handle(json_loads(msg.data))
+        finally:
+            ping.cancel()
+
+    async def _handle(self, message: dict):
+        channel = message.get("channel")
+        if channel == "userFills":
+            data = message.get("data", {})
+            address = self.addresses.get(data.get("user", "").lower())
+            if address is not None:
+                # El snapshot inicial cubre lo ocurrido entre la última consulta REST y la
+                # suscripción; lo ya alertado se descarta por marca de agua.
+                # Solo se guardan los fills: el intervalo cubierto lo fijan las consultas REST
+                try:
+                    fills = parse_fills(data.get("fills", []))
+                except HyperliquidResponseError as e:
+                    logging.error(f"StreamConnection: {e}")
+                    return
+                fill_store.add(address, fills)
+                await process_fills(self.app, address, fills)
+        elif channel == "subscriptionResponse":
+            data = message.get("data", {})
+            subscription = data.get("subscription", {})
+            if data.get("method") == "subscribe" and subscription.get("type") == "userFills":
+                user = subscription.get("user", "").lower()
+                if user in self.addresses:
+                    self.acked.add(user)
+        elif channel == "error":
+            # El error no dice qué suscripción rechaza: las no confirmadas siguen por
+            # REST y FillStream las libera en el próximo sync
+            self.error_at = time.monotonic()
+            logging.error(f"StreamConnection: error del servidor: {message.get('data')}")
+
+class FillStream:
+    """
+    Motor de streaming: reparte como mucho HL_WS_MAX_USERS direcciones seguidas
+    entre conexiones WebSocket de como máximo WS_MAX_USERS_PER_CONN cada una.
+    Las suscripciones sin confirmar pasado `confirm_timeout` (o tras un error
+    del servidor) se liberan, para que esas plazas las prueben otras direcciones.
+    """
+
+    def __init__(self, app, url: str = HL_WS_URL, max_users: int = HL_WS_MAX_USERS,
+                 max_users_per_conn: int = WS_MAX_USERS_PER_CONN,
+                 confirm_timeout: float = MONITOR_INTERVAL):
+        self.app = app
+        self.url = url
+        self.max_users = max_users
+        self.max_users_per_conn = max_users_per_conn
+        self.confirm_timeout = confirm_timeout
+        self.connections = []
+        # { address: StreamConnection }
+        self.owner = {}
+        # { address: time.monotonic() en que se liberó sin confirmar }
+        self.released = {}
+
+    async def sync(self, addresses):
+        """
+        Ajusta las suscripciones a la lista actual de direcciones seguidas; las
+        que no caben en HL_WS_MAX_USERS se quedan sin suscribir (REST). Las
+        plazas libres se dan primero a las direcciones nunca probadas y luego a
+        las liberadas hace más tiempo.
+        """
+        addresses = set(addresses)
+        for address in list(self.owner):
+            if address not in addresses:
+                await self.owner.pop(address).remove(address)
+        for conn in self.connections:
+            unconfirmed = conn.unconfirmed(self.confirm_timeout)
+            if unconfirmed:
+                logging.warning(f"FillStream: {len(unconfirmed)} suscripciones sin confirmar, se liberan")
+            for address in unconfirmed:
+                self.owner.pop(address, None)
+                self.released[address] = time.monotonic()
+                await conn.remove(address)
+        for address in list(self.released):
+            if address not in addresses:
+                del self.released[address]
+        candidates = sorted(addresses - self.owner.keys(), key=lambda a: self.released.get(a, 0))
+        for address in candidates:
+            if len(self.owner) >= self.max_users:
+                break
+            conn = next(
+                (c for c in self.connections if len(c.addresses) < self.max_users_per_conn),
+                None,
+            )
+            if conn is None:
+                conn = StreamConnection(self.app, self.url)
+                self.connections.append(conn)
+                conn.start()
+            self.owner[address] = conn
+            await conn.add(address)
+
+    def streaming(self, address: str) -> bool:
+        """
+        True si los fills de la dirección llegan por una suscripción confirmada.
+        """
+        conn = self.owner.get(address)
+        return conn is not None and address.lower() in conn.acked
+
+    async def close(self):
+        for conn in self.connections:
+            await conn.close()
+        self.connections = []
+        self.owner = {}
+        self.released = {}
+
+class HashRing:
+    """
+    Anillo de hashing consistente: al entrar o salir un nodo solo cambian de
+    dueño las claves de su tramo del anillo.
+    """
+
+    def __init__(self, nodes=(), replicas: int = HASH_RING_REPLICAS):
+        self.replicas = replicas
+        self._keys = []
+        self._nodes = {}
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+    def add(self, node):
+        for i in range(self.replicas):
+            h = self._hash(f"{node}#{i}")
+            self._nodes[h] = node
+            bisect.insort(self._keys, h)
+
+    def remove(self, node):
+        for i in range(self.replicas):
+            h = self._hash(f"{node}#{i}")
+            if self._nodes.pop(h, None) is not None:
+                self._keys.remove(h)
+
+    def node_for(self, key: str):
+        if not self._keys:
+            return None
+        idx = bisect.bisect(self._keys, self._hash(key)) % len(self._keys)
+        return self._nodes[self._keys[idx]]
+
+def poller_main(worker_id: int, control, results):
+    """
+    Proceso poller del modo sharding (ver shard_wallets).
+    """
+    logging.info(f"poller {worker_id}: arrancado (pid {os.getpid()})")
+    try:
+        asyncio.run(poller_loop(worker_id, control, results))
+    except KeyboardInterrupt:
+        pass
+
+async def poller_loop(worker_id: int, control, results):
+    """
+    Bucle de un poller: recibe por `control` las direcciones asignadas con su
+    marca de agua ("assign" / "release" / "boost" / "stop"), las consulta con su
+    propio PollScheduler y envía por `results` (address, start, until, fills),
+    con until el ms hasta el que están todos los fills. Termina con "stop" o si
+    el proceso del bot ha muerto sin pararlo (SIGKILL, falta de memoria).
+    """
+    global hl_client
+    # Cada poller tiene su propio cliente y su parte del límite de peso
+    hl_client = HyperliquidClient(weight_per_minute=POLLER_WEIGHT_PER_MINUTE)
+    scheduler = PollScheduler()
+    cursors = {}
+    stopped = False
+    parent = multiprocessing.parent_process()
+
+    def assigned_addresses():
+        nonlocal stopped
+        if parent is not None and not parent.is_alive():
+            logging.warning(f"poller {worker_id}: el proceso del bot ha muerto, saliendo")
+            stopped = True
+            return []
+        while True:
+            try:
+                message = control.get_nowait()
+            except queue.Empty:
+                break
+            if message[0] == "assign":
+                cursors.update(message[1])
+            elif message[0] == "release":
+                for address in message[1]:
+                    cursors.pop(address, None)
+            elif message[0] == "boost":
+                scheduler.boost(message[1])
+            elif message[0] == "stop":
+                stopped = True
+        return list(cursors)
+
+    async def poll(address):
+        cursor = cursors[address]
+        request_time = int(time.time() * 1000)
+        fills, truncated = await fetch_fills_since(address, cursor["time"])
+        results.put((address, cursor["time"], covered_until(fills, truncated, request_time), fills))
+        new_fills = new_fills_after(cursor, fills)
+        if address in cursors:
+            cursors[address] = advance_cursor(cursor, new_fills)
+        return len(new_fills)
+
+    try:
+        async for _ in scheduled_sweeps(scheduler, assigned_addresses, poll, f"poller {worker_id}"):
+            if stopped:
+                return
+    finally:
+        await hl_client.close()
+
+class PollerPool:
+    """
+    Lado del proceso de Telegram en el modo sharding: arranca POLLER_WORKERS
+    procesos poller, les reparte las direcciones seguidas con un HashRing y
+    procesa los fills que envían. Los pollers caídos salen del anillo y se
+    vuelven a arrancar; al cambiar el anillo solo se reasignan las direcciones
+    afectadas, que el nuevo dueño retoma desde la marca de agua de este proceso.
+    """
+
+    def __init__(self, app, workers: int = POLLER_WORKERS):
+        self.app = app
+        self.workers = workers
+        self._ctx = multiprocessing.get_context("spawn")
+        self.results = self._ctx.Queue()
+        self.ring = HashRing()
+        # { worker_id: (process, control_queue) }
+        self.processes = {}
+        # { address: worker_id }
+        self.owner = {}
+
+    def _spawn(self, worker_id: int):
+        control = self._ctx.Queue()
+        process = self._ctx.Process(
+            target=poller_main, args=(worker_id, control, self.results), daemon=True
+        )
+        process.start()
+        self.processes[worker_id] = (process, control)
+        self.ring.add(worker_id)
+
+    def start(self):
+        for worker_id in range(self.workers):
+            self._spawn(worker_id)
+
+    def check_workers(self):
+        """
+        Saca del anillo los pollers muertos y arranca uno nuevo en su lugar.
+        """
+        for worker_id, (process, _) in list(self.processes.items()):
+            if process.is_alive():
+                continue
+            logging.warning(f"PollerPool: poller {worker_id} caído (exit {process.exitcode}), rearrancando")
+            self.ring.remove(worker_id)
+            del self.processes[worker_id]
+            for address in [a for a, w in self.owner.items() if w == worker_id]:
+                del self.owner[address]
+            self._spawn(worker_id)
+
+    def rebalance(self, addresses):
+        """
+        Asigna cada dirección a su poller según el anillo.
+        """
+        addresses = set(addresses)
+        assign = {}
+        release = {}
+        for address in list(self.owner):
+            if address not in addresses:
+                release.setdefault(self.owner.pop(address), []).append(address)
+        for address in addresses:
+            worker_id = self.ring.node_for(address)
+            current = self.owner.get(address)
+            if current == worker_id:
+                continue
+            if current is not None:
+                release.setdefault(current, []).append(address)
+            assign.setdefault(worker_id, {})[address] = get_cursor(address)
+            self.owner[address] = worker_id
+        for worker_id, moved in release.items():
+            if worker_id in self.processes:
+                self.processes[worker_id][1].put(("release", moved))
+        for worker_id, cursors in assign.items():
+            self.processes[worker_id][1].put(("assign", cursors))
+
+    def boost(self, address: str):
+        worker_id = self.owner.get(address)
+        if worker_id in self.processes:
+            self.processes[worker_id][1].put(("boost", address))
+
+    async def read_results(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await loop.run_in_executor(None, self.results.get)
+            if item is None:
+                return
+            address, start_time, until, fills = item
+            if address not in subscribers:
+                continue
+            fill_store.add(address, fills, start_time, until)
+            await process_fills(self.app, address, fills)
+
+    async def close(self):
+        for _, (process, control) in self.processes.items():
+            control.put(("stop",))
+        self.results.put(None)
+        for _, (process, _) in self.processes.items():
+            await asyncio.get_running_loop().run_in_executor(None, process.join, 5)
+            if process.is_alive():
+                process.terminate()
+        self.processes = {}
+
+async def shard_wallets(app):
+    """
+    Modo sharding de monitor_wallets (POLLER_WORKERS > 0): los pollers hacen las
+    consultas y este proceso solo deduplica, alerta y, cada MONITOR_INTERVAL,
+    vigila los pollers y reparte las direcciones.
+    """
+    global poller_pool
+    pool = PollerPool(app)
+    pool.start()
+    poller_pool = pool
+    reader = asyncio.create_task(pool.read_results())
+    try:
+        while True:
+            pool.check_workers()
+            pool.rebalance(list(subscribers))
+            mark_sweep()
+            await asyncio.sleep(MONITOR_INTERVAL)
+    finally:
+        poller_pool = None
+        await pool.close()
+        reader.cancel()
+
+async def stream_wallets(app):
+    """
+    Modo streaming de monitor_wallets: las alertas llegan empujadas por el
+    WebSocket y cada MONITOR_INTERVAL se sincronizan las suscripciones. Las
+    direcciones sin suscripción confirmada (más de HL_WS_MAX_USERS, rechazadas
+    por el servidor o con la conexión caída) se consultan por REST con el mismo
+    planificador que monitor_wallets hasta que se confirman.
+    """
+    stream = FillStream(app)
+    poll = lambda address: check_address(app, address)
+    rest_addresses = lambda: [a for a in subscribers if not stream.streaming(a)]
+    last_sync = None
+    polled_by_rest = 0
+    try:
+        async for addresses, elapsed in scheduled_sweeps(poll_scheduler, rest_addresses, poll, "stream_wallets"):
+            if addresses:
+                MONITOR_SWEEP_SECONDS.observe(elapsed)
+            now = time.monotonic()
+            if last_sync is None or now - last_sync >= MONITOR_INTERVAL:
+                last_sync = now
+                await stream.sync(list(subscribers))
+                if len(poll_scheduler) != polled_by_rest:
+                    polled_by_rest = len(poll_scheduler)
+                    logging.info(f"stream_wallets: {polled_by_rest} direcciones por REST sin suscripción confirmada")
+    finally:
+        await stream.close()
 
 async def monitor_wallets(app):
     """
-    Revisa cada 20s las wallets de user_data y envía alertas si hay fills nuevos en últimos 10m.
+    Revisa las direcciones seguidas y envía alertas si hay fills nuevos desde la
+    última consulta (ver check_address). Cada dirección tiene su intervalo
+    (PollScheduler): empieza en MONITOR_INTERVAL segundos y se acorta o alarga
+    según su actividad. Cada dirección se consulta una sola vez aunque la sigan
+    varios chats (índice subscribers). Las direcciones que tocan se consultan en
+    paralelo (como máximo HL_MAX_CONCURRENCY a la vez y dentro del límite de peso
+    del cliente).
+    Con HL_STREAMING=1 delega en stream_wallets y con POLLER_WORKERS > 0 en shard_wallets.
+    """
+    if HL_STREAMING:
+        await stream_wallets(app)
+        return
+    if POLLER_WORKERS > 0:
+        await shard_wallets(app)
+        return
+    last_stats_log = time.monotonic()
+    poll = lambda address: check_address(app, address)
+    async for addresses, elapsed in scheduled_sweeps(poll_scheduler, lambda: subscribers, poll, "monitor_wallets"):
+        if addresses:
+            MONITOR_SWEEP_SECONDS.observe(elapsed)
+        now = time.monotonic()
+        if now - last_stats_log >= DEDUP_STATS_INTERVAL:
+            logging.info(f"monitor_wallets: deduplicación {latest_fills.stats()}")
+            last_stats_log = now
+
+def start_monitor(app):
+    """
+    Arranca monitor_wallets como tarea en background y la registra en monitor_status.
+    Se usa asyncio.create_task (no app.create_task, que se traga la excepción)
+    para que /healthz pueda distinguir un monitor caído.
+    """
+    now = time.time()
+    monitor_status["task"] = asyncio.create_task(monitor_wallets(app))
+    monitor_status["started_at"] = now
+    monitor_status["last_progress_at"] = now
+
+def monitor_state() -> str:
+    """
+    Estado de la tarea del monitor: running, stalled, crashed, stopped o not_started.
+    """
+    task = monitor_status["task"]
+    if task is None:
+        return "not_started"
+    if task.done():
+        if task.cancelled():
+            return "stopped"
+        return "crashed" if task.exception() is not None else "stopped"
+    last_progress = monitor_status["last_progress_at"] or 0
+    if time.time() - last_progress > MONITOR_STALL_SECONDS:
+        return "stalled"
+    return "running"
+
+async def watchdog(app):
+    """
+    Cada WATCHDOG_INTERVAL segundos comprueba el monitor y lo reinicia si ha
+    muerto o lleva más de MONITOR_STALL_SECONDS sin progresar.
     """
     while True:
-        for chat_id, wallets in user_data.items():
-            for wallet in wallets:
-                address = wallet["address"]
-                name = wallet["name"]
-                fills = await fetch_fills(address, 10)
-                for fill in fills:
-                    key = f"{address}-{fill['time']}"
-                    if key not in latest_fills:
-                        latest_fills[key] = True
-                        coin = fill["coin"]
-                        size = float(fill["size"])
-                        side = "LONG" if fill["isTaker"] else "SHORT"
-                        price = float(fill["px"])
-                        total = size * price
-                        dt = datetime.utcfromtimestamp(fill["time"] / 1000) + timedelta(hours=2)
-                        dt_str = dt.strftime("%d/%m/%Y %H:%M")
-                        text_alert = (
-                            f"📡 <b>{name}</b>\n"
-                            f"🟢 <b>Open {side}</b> {size} {coin} (${total:,.2f})\n"
-                            f"🕒 {dt_str} UTC+2"
-                        )
-                        try:
-                            await app.bot.send_message(chat_id=chat_id, text=text_alert, parse_mode="HTML")
-                        except Exception as e:
-                            logging.error(f"Error sending alert: {e}")
-        await asyncio.sleep(20)
+        await asyncio.sleep(WATCHDOG_INTERVAL)
+        state = monitor_state()
+        if state == "running":
+            continue
+        task = monitor_status["task"]
+        if state == "crashed":
+            logging.error("watchdog: monitor_wallets ha muerto", exc_info=task.exception())
+        else:
+            logging.error(f"watchdog: monitor_wallets en estado {state}, reiniciando")
+        if task is not None and not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        monitor_status["restarts"] += 1
+        start_monitor(app)
 
 async def set_bot_commands(app):
     """
@@ -491,12 +3326,35 @@ async def set_bot_commands(app):
 
 async def on_startup(app):
     """
-    Registrado en post_init: arranca monitor_wallets como tarea en background
-    y registra los comandos globales.
+    Registrado en post_init: abre el cliente de Hyperliquid y la persistencia,
+    arranca la cola de alertas, carga las suscripciones en background, arranca
+    monitor_wallets (vigilado por watchdog) como tareas en background y registra
+    los comandos globales.
     """
-    app.create_task(monitor_wallets(app))
+    await hl_client.start()
+    await storage.open()
+    alert_sender.start(app.bot)
+    app.create_task(load_subscriptions())
+    start_monitor(app)
+    monitor_status["watchdog"] = asyncio.create_task(watchdog(app))
     await set_bot_commands(app)
 
+async def on_shutdown(app):
+    """
+    Registrado en post_shutdown: para el monitor y el watchdog, envía las
+    alertas en cola (como mucho ALERT_DRAIN_TIMEOUT s), cierra el pool de
+    conexiones de Hyperliquid y escribe lo pendiente en la persistencia. Las
+    marcas de agua de las alertas que no se llegaron a enviar no se guardan.
+    """
+    for name in ("watchdog", "task"):
+        task = monitor_status[name]
+        if task is not None and not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+    await alert_sender.close()
+    await hl_client.close()
+    await storage.close()
+
 #BOTÓN FIJO
 async def setup_bot(application):
     await application.bot.set_my_commands([
@@ -519,7 +3377,7 @@ def main():
 # Inicializar bot
 # -----------------------
 
-app = ApplicationBuilder().token(TOKEN).post_init(on_startup).build()
+app = ApplicationBuilder().token(TOKEN).post_init(on_startup).post_shutdown(on_shutdown).build()
 app.add_handler(CommandHandler("start", start_command))
 app.add_handler(CallbackQueryHandler(menu_handler, pattern="^menu_"))
 app.add_handler(CommandHandler("add", add_command))
@@ -529,6 +3387,7 @@ app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
 app.add_handler(CommandHandler("list", list_command))
 app.add_handler(CommandHandler("positions", positions_command))
 app.add_handler(CallbackQueryHandler(positions_callback, pattern="^positions_"))
+app.add_handler(CallbackQueryHandler(positions_all_callback, pattern="^posall_"))
 app.add_handler(CommandHandler("summary", summary_command))
 app.add_handler(CallbackQueryHandler(summary_callback, pattern="^summary_"))
 
@@ -539,12 +3398,145 @@ app.add_handler(CallbackQueryHandler(summary_callback, pattern="^summary_"))
 async def handle(request):
     return web.Response(text="Bot is running")
 
+async def metrics_handler(request):
+    """
+    /metrics: métricas en formato de exposición de Prometheus.
+    """
+    return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")
+
+def telegram_status() -> dict:
+    """
+    Cómo recibe el bot los updates de Telegram y si los está recibiendo.
+    """
+    if WEBHOOK_URL:
+        last_update = webhook_status["last_update_at"]
+        return {
+            "mode": "webhook",
+            "receiving": bool(app.running and webhook_status["registered"]),
+            "last_update_at": datetime.utcfromtimestamp(last_update).isoformat() + "Z" if last_update else None,
+        }
+    return {"mode": "polling", "receiving": bool(app.updater and app.updater.running)}
+
+def health_report() -> dict:
+    """
+    Estado del bot para /healthz y /readyz.
+    """
+    last_sweep = monitor_status["last_sweep_at"]
+    return {
+        "monitor": {
+            "state": monitor_state(),
+            "last_sweep_at": datetime.utcfromtimestamp(last_sweep).isoformat() + "Z" if last_sweep else None,
+            "restarts": monitor_status["restarts"],
+        },
+        "telegram": telegram_status(),
+        "breaker": hl_client.breaker.state,
+        "subscriptions_loaded": monitor_status["subscriptions_loaded"],
+    }
+
+async def healthz_handler(request):
+    """
+    /healthz: 200 si el monitor está vivo y progresando, 503 si no.
+    """
+    report = health_report()
+    healthy = report["monitor"]["state"] == "running"
+    report["status"] = "ok" if healthy else "unhealthy"
+    return web.json_response(report, status=200 if healthy else 503)
+
+async def readyz_handler(request):
+    """
+    /readyz: 200 si además Telegram recibe updates, la API responde (circuito
+    cerrado) y las suscripciones están cargadas.
+    """
+    report = health_report()
+    ready = (
+        report["monitor"]["state"] == "running"
+        and report["telegram"]["receiving"]
+        and report["breaker"] == "closed"
+        and report["subscriptions_loaded"]
+    )
+    report["status"] = "ready" if ready else "not_ready"
+    return web.json_response(report, status=200 if ready else 503)
+
+async def telegram_webhook_handler(request):
+    """
+    Modo webhook: comprueba el secreto y pasa el update directamente a
+    app.process_update, sin la cola del updater.
+    """
+    secret = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not hmac.compare_digest(secret.encode(), WEBHOOK_SECRET.encode()):
+        WEBHOOK_UPDATES.inc(result="forbidden")
+        return web.Response(status=403)
+    if not app.running:
+        # Telegram reintenta el update cuando el bot ya esté arrancado
+        WEBHOOK_UPDATES.inc(result="not_running")
+        return web.Response(status=503)
+    try:
+        update = Update.de_json(await request.json(), app.bot)
+    except (ValueError, TypeError, KeyError) as e:
+        logging.warning(f"Update de webhook inválido: {e}")
+        WEBHOOK_UPDATES.inc(result="invalid")
+        return web.Response(status=400)
+    # Se responde sin esperar al handler: un /summary largo haría que Telegram
+    # diera el update por perdido y lo reenviara
+    app.create_task(app.process_update(update), update=update)
+    webhook_status["last_update_at"] = time.time()
+    WEBHOOK_UPDATES.inc(result="ok")
+    return web.Response()
+
+async def profile_handler(request):
+    """
+    /debug/profile?seconds=N&format=folded|top: perfil por muestreo (tiempo de
+    CPU) del event loop durante N segundos (máx. PROFILE_MAX_SECONDS). Requiere la
+    cabecera Authorization: Bearer ADMIN_TOKEN.
+    """
+    auth = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(auth.encode(), f"Bearer {ADMIN_TOKEN}".encode()):
+        return web.Response(status=401, text="unauthorized")
+    try:
+        seconds = min(PROFILE_MAX_SECONDS, max(0.1, float(request.query.get("seconds", "10"))))
+    except ValueError:
+        return web.Response(status=400, text="invalid seconds")
+    output = request.query.get("format", "folded")
+    if output not in ("folded", "top"):
+        return web.Response(status=400, text="format must be folded or top")
+    if profile_lock.locked():
+        return web.Response(status=409, text="a profile is already running")
+    async with profile_lock:
+        logging.info(f"profile_handler: perfilando {seconds:.1f}s")
+        counts = await profile_event_loop(seconds)
+    total = sum(counts.values())
+    if output == "folded":
+        lines = [f"{stack} {n}" for stack, n in sorted(counts.items(), key=lambda x: -x[1])]
+    else:
+        # Muestras por función hoja (tiempo propio)
+        leaves = {}
+        for stack, n in counts.items():
+            leaf = stack.rsplit(";", 1)[-1]
+            leaves[leaf] = leaves.get(leaf, 0) + n
+        lines = [f"# {total} samples every {PROFILE_INTERVAL * 1000:.0f}ms of CPU over {seconds:.1f}s"]
+        lines += [
+            f"{n:>7} {n / total * 100:5.1f}%  {leaf}"
+            for leaf, n in sorted(leaves.items(), key=lambda x: -x[1])[:50]
+        ]
+    return web.Response(text="\n".join(lines) + "\n")
+
 async def start_web_server():
     """
-    Inicia un servidor web en / para mantener Render contento.
+    Inicia un servidor web en / para mantener Render contento y expone /metrics,
+    /healthz, /readyz, en modo webhook la ruta de updates de Telegram y, con
+    ADMIN_TOKEN, /debug/profile.
     """
     app_web = web.Application()
-    app_web.add_routes([web.get("/", handle)])
+    app_web.add_routes([
+        web.get("/", handle),
+        web.get("/metrics", metrics_handler),
+        web.get("/healthz", healthz_handler),
+        web.get("/readyz", readyz_handler),
+    ])
+    if WEBHOOK_URL:
+        app_web.add_routes([web.post(WEBHOOK_PATH, telegram_webhook_handler)])
+    if ADMIN_TOKEN:
+        app_web.add_routes([web.get("/debug/profile", profile_handler)])
     runner = web.AppRunner(app_web)
     await runner.setup()
     site = web.TCPSite(runner, "0.0.0.0", 10000)
@@ -554,17 +3546,57 @@ async def start_web_server():
 # Función principal
 # -----------------------
 
+async def start_webhook():
+    """
+    Registra WEBHOOK_URL + WEBHOOK_PATH en Telegram con el secreto. Al parar no
+    se borra: otras réplicas pueden seguir recibiendo updates.
+    """
+    await app.bot.set_webhook(
+        url=WEBHOOK_URL + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+        allowed_updates=Update.ALL_TYPES,
+    )
+    webhook_status["registered"] = True
+    logging.info(f"Webhook registrado en {WEBHOOK_URL + WEBHOOK_PATH}")
+
 async def main():
     # 1) Arrancar servidor web en background
     asyncio.create_task(start_web_server())
 
-    # 2) Inicializar y arrancar bot sin conflictos de event loop
+    # 2) Inicializar y arrancar bot sin conflictos de event loop.
+    #    initialize()/start() no llaman a post_init/post_shutdown (solo lo hace
+    #    run_polling), así que se invocan a mano.
     await app.initialize()
+    await app.post_init(app)
     await app.start()
-    await app.updater.start_polling()
+    if WEBHOOK_URL:
+        # Los updates llegan por POST a WEBHOOK_PATH (ver telegram_webhook_handler)
+        await start_webhook()
+    else:
+        # start_polling borra antes cualquier webhook registrado
+        await app.updater.start_polling()
 
-    # 3) Mantener el loop vivo
-    await asyncio.Event().wait()
+    # 3) Mantener el loop vivo hasta SIGTERM (así para Render el servicio) o
+    #    SIGINT, para que el apagado (envío de alertas en cola, escritura de la
+    #    persistencia) se ejecute antes de salir
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            # Windows: SIGINT llega como KeyboardInterrupt
+            pass
+    try:
+        await stop_event.wait()
+        logging.info("main: señal de parada recibida, apagando")
+    finally:
+        if app.updater.running:
+            await app.updater.stop()
+        await app.stop()
+        await app.post_shutdown(app)
+        await app.shutdown()
 
 if __name__ == "__main__":
     asyncio.run(main())